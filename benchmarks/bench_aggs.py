@@ -0,0 +1,37 @@
+"""
+Benchmark: building bodies with many sibling aggregations
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_aggs.py`
+"""
+
+import timeit
+
+from bodybuilder import BodyBuilder
+
+
+def make_builder(siblings):
+    builder = BodyBuilder()
+    for i in range(siblings):
+        builder.aggregation('terms', f'field_{i}',
+                            lambda a: a.aggregation('avg', 'grade'))
+    return builder
+
+
+def rebuild(builder):
+    builder._dirty = True
+    return builder.build()
+
+
+def main(number=20):
+    for siblings in [10, 100, 1000]:
+        builder = make_builder(siblings)
+        seconds = timeit.timeit(lambda: rebuild(builder), number=number)
+        json_seconds = timeit.timeit(builder.build_json, number=number)
+        print(f"{siblings:5} sibling aggs: "
+              f"build() {seconds / number * 1e3:8.2f} ms  "
+              f"build_json() {json_seconds / number * 1e3:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark: building bodies from a parameter grid in one process vs a pool
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_batch.py`
+"""
+
+import itertools
+import os
+import time
+
+from bodybuilder import BodyBuilder
+from bodybuilder.batch import iter_build
+
+
+def chain(user, count, tag):
+    builder = BodyBuilder() \
+        .query('match', 'message', 'this is a test') \
+        .filter('term', 'user', user) \
+        .filter('range', 'count', {'gt': count}) \
+        .orFilter('term', 'tag', tag) \
+        .aggregation('terms', 'user') \
+        .sort('timestamp', 'desc') \
+        .size(10)
+    for i in range(20):
+        builder.notFilter('term', 'status', f'status_{i}')
+    return builder
+
+
+def grid():
+    for user, count, tag in itertools.product(
+            range(100), range(50), ['a', 'b', 'c', 'd']):
+        yield {'user': f'user_{user}', 'count': count, 'tag': tag}
+
+
+def main():
+    start = time.perf_counter()
+    single = sum(len(chain(**params).build_json()) for params in grid())
+    single_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pooled = sum(len(body) for body in iter_build(chain, grid(),
+                                                  chunksize=500,
+                                                  as_json=True))
+    pooled_time = time.perf_counter() - start
+
+    assert single == pooled
+    bodies = sum(1 for _ in grid())
+    print(f"{os.cpu_count()} CPUs, {bodies} bodies")
+    print(f"single process: {bodies / single_time:12.0f} bodies/sec")
+    print(f"process pool:   {bodies / pooled_time:12.0f} bodies/sec")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+"""
+Benchmark: memory and build time of builders with many clauses
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_clauses.py`
+"""
+
+import time
+import tracemalloc
+
+from bodybuilder import BodyBuilder
+
+
+def make_builder(clauses):
+    builder = BodyBuilder()
+    for i in range(clauses):
+        builder.filter('term', 'user', f'user_{i}')
+        builder.orFilter('range', 'count', {'gte': i}, {'boost': 2})
+    for i in range(clauses // 10):
+        builder.aggregation('terms', f'field_{i}', {'size': 10})
+    return builder
+
+
+def main(clauses=10000, number=10):
+    tracemalloc.start()
+    builder = make_builder(clauses)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(number):
+        make_builder(clauses)
+    register = (time.perf_counter() - start) / number
+
+    start = time.perf_counter()
+    for _ in range(number):
+        builder._dirty = True
+        builder.build()
+    build = (time.perf_counter() - start) / number
+
+    print(f"{clauses} clauses: {memory / 1024:8.1f} KiB held by the builder, "
+          f"register {register * 1e3:7.2f} ms, build {build * 1e3:7.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
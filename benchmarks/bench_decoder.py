@@ -0,0 +1,68 @@
+"""
+Benchmark: AggregationDecoder against a generic recursive walk of the same
+response, on 100 terms buckets of 1000 date histogram buckets each
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_decoder.py`
+"""
+
+import timeit
+
+from bodybuilder import BodyBuilder
+
+USERS, DAYS = 100, 1000
+
+
+def builder():
+    return BodyBuilder().aggregation('terms', 'user', lambda a: a
+                                     .aggregation('date_histogram', 'timestamp',
+                                                  lambda d: d
+                                                  .aggregation('max', 'grade')
+                                                  .aggregation('avg', 'load')))
+
+
+def response():
+    return {'aggregations': {'agg_terms_user': {'buckets': [
+        {'key': f'user_{u}', 'doc_count': DAYS,
+         'agg_date_histogram_timestamp': {'buckets': [
+             {'key': d * 86400000, 'doc_count': 1,
+              'agg_max_grade': {'value': float(d)},
+              'agg_avg_load': {'value': float(u)}}
+             for d in range(DAYS)]}}
+        for u in range(USERS)]}}}
+
+
+def walk(node, keys, rows):
+    """
+    Generic decoding: inspect every node to find buckets and metrics
+    """
+    for name, agg in node.items():
+        if not isinstance(agg, dict) or 'buckets' not in agg:
+            continue
+        for bucket in agg['buckets']:
+            row = dict(keys, **{name: bucket['key'],
+                                'doc_count': bucket['doc_count']})
+            for metric, value in bucket.items():
+                if isinstance(value, dict) and 'value' in value:
+                    row[metric] = value['value']
+            rows.append(row)
+            walk(bucket, {**keys, name: bucket['key']}, rows)
+    return rows
+
+
+def main():
+    decoder = builder().aggregation_decoder()
+    data = response()
+    cases = [
+        ('generic walk', lambda: walk(data['aggregations'], {}, [])),
+        ('decoder lists', lambda: decoder.decode(data)),
+        ('decoder arrays', lambda: decoder.decode(data, columns='array')),
+    ]
+    for name, case in cases:
+        seconds = min(timeit.repeat(case, number=1, repeat=5))
+        print(f"{name:15} {seconds * 1000:8.1f} ms "
+              f"{seconds / (USERS * DAYS) * 1e9:6.0f} ns/bucket")
+
+
+if __name__ == '__main__':
+    main()
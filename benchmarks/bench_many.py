@@ -0,0 +1,60 @@
+"""
+Benchmark: registering 100k values with a loop of filter() calls vs one
+filter_many() call
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_many.py`
+"""
+
+import array
+import time
+import tracemalloc
+
+from bodybuilder import BodyBuilder
+
+COUNT = 100000
+
+
+def looped():
+    builder = BodyBuilder()
+    for i in range(COUNT):
+        builder.orFilter('term', 'id', i)
+    for i in range(0, COUNT, 10):
+        builder.notFilter('range', 'count', {'gte': i, 'lt': i + 10})
+    return builder
+
+
+def many():
+    ids = array.array('q', range(COUNT))
+    breakpoints = [(i, i + 10) for i in range(0, COUNT, 10)]
+    return BodyBuilder() \
+        .orFilter_many('term', 'id', ids) \
+        .notFilter_many('range', 'count', breakpoints)
+
+
+def measure(make):
+    start = time.perf_counter()
+    builder = make()
+    registered = time.perf_counter() - start
+    start = time.perf_counter()
+    length = len(builder.build_json())
+    serialized = time.perf_counter() - start
+
+    tracemalloc.start()
+    builder = make()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return registered, serialized, held, length
+
+
+def main():
+    for name, make in [('filter() loop', looped), ('filter_many()', many)]:
+        registered, serialized, held, length = measure(make)
+        print(f"{name:14} register {registered * 1000:8.1f} ms  "
+              f"build_json {serialized * 1000:8.1f} ms  "
+              f"builder holds {held / 2 ** 20:6.1f} MiB  "
+              f"({length} chars)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Benchmark: BodyBuilder.from_body on growing bodies, which should scale
+linearly with the size of the body
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_parser.py`
+"""
+
+import gc
+import timeit
+
+from bodybuilder import BodyBuilder
+
+
+def body(count):
+    builder = BodyBuilder().query('match', 'message', 'this is a test')
+    for i in range(count):
+        builder.filter('term', 'user', f'user_{i}')
+        builder.notFilter('range', 'count', {'gte': i})
+        builder.aggregation('terms', f'field_{i}', lambda a: a
+                            .aggregation('max', 'grade'))
+    return builder.sort('timestamp').size(10).build()
+
+
+def main():
+    # the cyclic GC walks every live object and would hide the scaling
+    gc.disable()
+    for count in (1000, 10000, 100000):
+        stored = body(count)
+        seconds = min(timeit.repeat(lambda: BodyBuilder.from_body(stored),
+                                    number=1, repeat=3))
+        print(f"{count * 3:7} clauses: {seconds * 1000:9.1f} ms "
+              f"{seconds / (count * 3) * 1e6:6.2f} us/clause")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: build_json() vs json.dumps(build())
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_serializer.py`
+"""
+
+import json
+import timeit
+import tracemalloc
+
+from bodybuilder import BodyBuilder
+
+
+def make_builder(clauses=200):
+    builder = BodyBuilder().query('match', 'message', 'this is a test')
+    for i in range(clauses):
+        builder.filter('term', f'field_{i % 10}', f'value_{i}')
+        builder.orFilter('range', 'count', {'gte': i, 'lt': i + 10})
+    return builder \
+        .aggregation('terms', 'user',
+                     lambda a: a.aggregation('avg', 'grade')) \
+        .sort('timestamp', 'desc') \
+        .size(10)
+
+
+def dict_path(builder):
+    builder._dirty = True
+    return json.dumps(builder.build())
+
+
+def json_path(builder):
+    return builder.build_json()
+
+
+def peak_memory(func, builder):
+    tracemalloc.start()
+    func(builder)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main(number=500):
+    builder = make_builder()
+    assert dict_path(builder) == json_path(builder)
+    size = len(json_path(builder))
+
+    for name, func in [('json.dumps(build())', dict_path),
+                       ('build_json()', json_path)]:
+        seconds = timeit.timeit(lambda: func(builder), number=number)
+        print(f"{name:20} {size * number / seconds / 1e6:8.2f} MB/sec  "
+              f"{peak_memory(func, builder) / 1024:8.1f} KiB peak per body")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+"""
+Benchmark: rendering a compiled template vs rebuilding the builder chain
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_template.py`
+"""
+
+import timeit
+
+from bodybuilder import BodyBuilder, Param
+
+
+def chain(user, count):
+    return BodyBuilder() \
+        .query('match', 'message', 'this is a test') \
+        .filter('term', 'user', user) \
+        .filter('range', 'count', {'gt': count}) \
+        .orFilter('term', 'tag', 'a') \
+        .notFilter('term', 'status', 'deleted') \
+        .aggregation('terms', 'user') \
+        .sort('timestamp', 'desc') \
+        .size(10)
+
+
+def main(number=20000):
+    template = chain(Param('user'), Param('count')).compile()
+
+    rebuild = timeit.timeit(lambda: chain('kimchy', 5).build(), number=number)
+    render = timeit.timeit(lambda: template.render(user='kimchy', count=5),
+                           number=number)
+
+    print(f"rebuild chain: {number / rebuild:12.0f} bodies/sec")
+    print(f"render:        {number / render:12.0f} renders/sec")
+    print(f"speedup:       {rebuild / render:12.1f}x")
+
+
+if __name__ == '__main__':
+    main()
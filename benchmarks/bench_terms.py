@@ -0,0 +1,33 @@
+"""
+Benchmark: 5k term orFilters on one field with and without terms batching
+
+Run from the repository root with
+`PYTHONPATH=. python benchmarks/bench_terms.py`
+"""
+
+import json
+import timeit
+
+from bodybuilder import BodyBuilder
+
+
+def make_builder(ids, **options):
+    builder = BodyBuilder(**options)
+    for i in ids:
+        builder.orFilter('term', 'id', i)
+    return builder
+
+
+def main(values=5000, number=20):
+    ids = [f'doc-{i:08d}' for i in range(values)]
+    for name, options in [('term clauses', {}),
+                          ('batched terms', {'batch_terms': True})]:
+        seconds = timeit.timeit(
+            lambda: make_builder(ids, **options).build(), number=number)
+        size = len(json.dumps(make_builder(ids, **options).build()))
+        print(f"{name:14} build {seconds / number * 1e3:8.2f} ms  "
+              f"body {size / 1024:8.1f} KiB")
+
+
+if __name__ == '__main__':
+    main()
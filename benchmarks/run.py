@@ -0,0 +1,200 @@
+"""
+Benchmark suite for the BodyBuilder hot paths
+
+Run from the repository root with
+
+    PYTHONPATH=. python benchmarks/run.py
+    PYTHONPATH=. python benchmarks/run.py --save baseline.json
+    PYTHONPATH=. python benchmarks/run.py --compare baseline.json
+
+Every case reports ops/sec (best of several repeats) and the peak memory of a
+single run. `--compare` exits with status 1 if a case got slower than the
+baseline by more than `--threshold`.
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+
+from bodybuilder import BodyBuilder, Param
+
+CASES = {}
+
+
+def case(func):
+    CASES[func.__name__] = func
+    return func
+
+
+@case
+def simple_query():
+    return BodyBuilder().query('match', 'message', 'this is a test').build()
+
+
+@case
+def large_bool_query():
+    builder = BodyBuilder().query('match', 'message', 'this is a test')
+    for i in range(100):
+        builder.filter('term', 'user', f'user_{i}')
+        builder.orFilter('range', 'count', {'gte': i, 'lt': i + 10})
+        builder.notFilter('term', 'status', f'status_{i}')
+    return builder.build()
+
+
+def _nest(depth):
+    if depth == 0:
+        return lambda q: q.query('match', 'comments.name', 'john')
+    return lambda q: q.query('nested', 'path', f'level_{depth}',
+                             _nest(depth - 1))
+
+
+@case
+def deep_nested_query():
+    return BodyBuilder().query('nested', 'path', 'root', _nest(20)).build()
+
+
+def _nest_aggs(depth):
+    if depth == 0:
+        return lambda a: a.aggregation('avg', 'grade')
+    return lambda a: a \
+        .aggregation('terms', f'field_{depth}', _nest_aggs(depth - 1)) \
+        .aggregation('max', 'grade')
+
+
+@case
+def aggregation_tree():
+    builder = BodyBuilder()
+    for i in range(10):
+        builder.aggregation('terms', f'root_{i}', _nest_aggs(5))
+    return builder.build()
+
+
+@case
+def deduplicate_facets():
+    builder = BodyBuilder(deduplicate=True)
+    for i in range(2000):
+        builder.filter('term', 'status', f'status_{i % 50}')
+        builder.orFilter('range', 'count', {'gte': i % 100})
+    return builder.build()
+
+
+@case
+def sort_heavy():
+    builder = BodyBuilder().query('match_all')
+    for i in range(200):
+        builder.sort(f'field_{i}', 'desc' if i % 2 else 'asc')
+    return builder.size(100).build()
+
+
+_REPEATED = BodyBuilder() \
+    .query('match', 'message', 'this is a test') \
+    .filter('term', 'user', 'kimchy') \
+    .aggregation('terms', 'user')
+
+
+@case
+def repeated_get_query():
+    for _ in range(10):
+        _REPEATED.getQuery()
+
+
+_BASE = BodyBuilder().filter('term', 'tenant', 'a')
+for _i in range(500):
+    _BASE.notFilter('term', 'acl', f'group_{_i}')
+
+
+@case
+def clone_and_extend():
+    for i in range(10):
+        _BASE.clone().filter('term', 'user', f'user_{i}').size(10)
+
+
+_FROZEN = _BASE.freeze()
+
+
+@case
+def frozen_extend():
+    for i in range(10):
+        _FROZEN.filter('term', 'user', f'user_{i}').size(10)
+
+
+_TEMPLATE = BodyBuilder() \
+    .query('match', 'message', Param('message')) \
+    .filter('term', 'user', Param('user')) \
+    .compile()
+
+
+@case
+def template_render():
+    return _TEMPLATE.render(message='this is a test', user='kimchy')
+
+
+@case
+def build_json():
+    builder = BodyBuilder().query('match', 'message', 'this is a test')
+    for i in range(100):
+        builder.filter('term', 'user', f'user_{i}')
+    return builder.build_json()
+
+
+def measure(func, repeat=5):
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'ops_per_sec': number / best, 'peak_memory': peak}
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result['ops_per_sec'] / baseline[name]['ops_per_sec']
+        if ratio < 1 - threshold:
+            regressions.append((name, ratio))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('cases', nargs='*', help="cases to run, default all")
+    parser.add_argument('--save', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON file to compare to")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="allowed slowdown before a case is flagged")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    unknown = set(args.cases) - set(CASES)
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(sorted(unknown))}")
+
+    results = {}
+    for name in args.cases or CASES:
+        results[name] = measure(CASES[name], repeat=args.repeat)
+        print(f"{name:24} {results[name]['ops_per_sec']:14.1f} ops/sec "
+              f"{results[name]['peak_memory'] / 1024:10.1f} KiB peak")
+
+    if args.save:
+        with open(args.save, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        regressions = compare(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"REGRESSION {name}: {ratio:.0%} of baseline ops/sec")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
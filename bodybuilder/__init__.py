@@ -1 +1,8 @@
-from .builder import BodyBuilder
+from .budget import Budget, BudgetExceededError, BudgetWarning
+from .builder import BodyBuilder, FrozenBodyBuilder
+from .clauses import Volatile
+from .export import iter_export, write_export
+from .msearch import iter_msearch, iter_msearch_template, write_msearch
+from .profiling import profile_builds
+from .spec import build_spec, compile_spec
+from .template import Param, Template
@@ -0,0 +1,111 @@
+"""
+Mass generation of bodies from one spec in a process pool
+
+The spec is sent once to every worker process, and the parameter sets in
+chunks, so it has to be picklable: a `Template` (or a builder with `Param`
+placeholders, which is compiled to one), or a module level function taking
+the parameters as keyword arguments and returning a builder or a body.
+Nested clauses of a spec builder pickle fine once their lambdas have been
+resolved, i.e. unless they are `Volatile`; a builder can also be passed in
+place of a nested lambda.
+"""
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+
+from .builder import BodyBuilder
+from .template import Template
+
+_worker_spec = None
+
+
+def _init_worker(spec):
+    global _worker_spec
+    _worker_spec = spec
+
+
+def _render(spec, params, as_json):
+    if isinstance(spec, Template):
+        body = spec.render(**params)
+    else:
+        body = spec(**params)
+    if isinstance(body, BodyBuilder):
+        return body.build_json() if as_json else body.build()
+    return json.dumps(body) if as_json else body
+
+
+def _build_chunk(chunk, as_json):
+    return [_render(_worker_spec, params, as_json) for params in chunk]
+
+
+def _chunks(param_sets, chunksize):
+    iterator = iter(param_sets)
+    while True:
+        chunk = list(itertools.islice(iterator, chunksize))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_build(spec, param_sets, max_workers=None, chunksize=256,
+               ordered=True, as_json=False):
+    """
+    Lazily yield the body of `spec` rendered with each parameter dict of
+    `param_sets`, built in a pool of `max_workers` processes
+
+    Bodies are yielded in the order of `param_sets`, or as
+    `(index, body)` pairs in completion order with `ordered=False`. With
+    `as_json` they are JSON strings, which are also cheaper to send back
+    from the workers. At most two chunks per worker are in flight, so
+    `param_sets` can be a generator of any length.
+    """
+    if isinstance(spec, BodyBuilder):
+        spec = spec.compile()
+    workers = max_workers or os.cpu_count() or 1
+    executor = concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(spec,))
+    pending = collections.deque()
+    try:
+        start = 0
+        for chunk in _chunks(param_sets, chunksize):
+            if len(pending) >= 2 * workers:
+                yield from _collect(pending, ordered)
+            pending.append((start, executor.submit(_build_chunk, chunk,
+                                                   as_json)))
+            start += len(chunk)
+        while pending:
+            yield from _collect(pending, ordered)
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def _collect(pending, ordered):
+    """
+    Yield the results of the next finished chunk and drop it from `pending`
+    """
+    if ordered:
+        _, future = pending.popleft()
+        yield from future.result()
+        return
+    done, _ = concurrent.futures.wait(
+        [future for _, future in pending],
+        return_when=concurrent.futures.FIRST_COMPLETED)
+    for item in list(pending):
+        start, future = item
+        if future in done:
+            pending.remove(item)
+            yield from enumerate(future.result(), start)
+            return
+
+
+def build_batch(spec, param_sets, max_workers=None, chunksize=256,
+                as_json=False):
+    """
+    List of the bodies yielded by `iter_build`, in the order of `param_sets`
+    """
+    return list(iter_build(spec, param_sets, max_workers, chunksize,
+                           as_json=as_json))
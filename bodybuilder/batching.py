@@ -0,0 +1,49 @@
+"""
+Collapsing of many `term` clauses on one field into `terms` clauses
+
+Under `should` (any of) and `must_not` (none of), a group of
+`('term', field, value)` clauses matches the same documents as a single
+`('terms', field, [values])` clause. Under `must`/`filter` the term clauses
+are and-ed, so they are left alone.
+"""
+from .clauses import QueryClause
+
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+def _is_plain_term(clause):
+    return (
+        clause.type == 'term'
+        and clause.options is None
+        and clause.nested is None
+        and isinstance(clause.field, str)
+        and isinstance(clause.value, _SCALAR_TYPES)
+    )
+
+
+def batch_term_clauses(clauses, max_terms_count):
+    """
+    Replace every group of plain term clauses on the same field by terms
+    clauses of at most `max_terms_count` values, at the position of the
+    first clause of the group
+    """
+    values = {}
+    for clause in clauses:
+        if _is_plain_term(clause):
+            values.setdefault(clause.field, []).append(clause.value)
+
+    batched = []
+    emitted = set()
+    for clause in clauses:
+        if not _is_plain_term(clause) or len(values[clause.field]) < 2:
+            batched.append(clause)
+            continue
+        if clause.field in emitted:
+            continue
+        emitted.add(clause.field)
+        field_values = values[clause.field]
+        for start in range(0, len(field_values), max_terms_count):
+            batched.append(QueryClause(
+                'terms', clause.field,
+                field_values[start:start + max_terms_count]))
+    return batched
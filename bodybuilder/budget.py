@@ -0,0 +1,162 @@
+"""
+Size and complexity budgets checked while a builder is being filled
+
+Every builder keeps running totals of its clauses, nesting depth,
+aggregations and an estimate of the size of its JSON body. They are updated
+by each `query()`/`filter()`/`aggregation()`/option call from the size of
+its arguments and the totals of its nested builder only, so a check never
+walks the rest of the builder.
+"""
+import sys
+import warnings
+
+from .clauses import _NO_FIELD, ClauseGroup, Volatile
+
+# bytes added around a value, e.g. `{"type": ...}` and the `, ` separator
+_CLAUSE_OVERHEAD = 6
+_SORT_OVERHEAD = 14
+# `{"gte": , "lt": }` around the bounds of a range
+_RANGE_OVERHEAD = 17
+
+
+_PACKAGE = __name__.rpartition('.')[0]
+
+
+def _caller_stacklevel():
+    """
+    `stacklevel` of a warning issued by the caller which points at the first
+    frame outside of this package, whichever chain method got there
+    """
+    frame = sys._getframe(1)
+    level = 1
+    while frame is not None and \
+            frame.f_globals.get('__name__', '').partition('.')[0] == _PACKAGE:
+        frame = frame.f_back
+        level += 1
+    return level
+
+
+class BudgetExceededError(ValueError):
+    pass
+
+
+class BudgetWarning(UserWarning):
+    pass
+
+
+def estimate_size(value):
+    """
+    Approximate length of the JSON encoding of `value`
+    """
+    if isinstance(value, str):
+        return len(value) + 2
+    if isinstance(value, dict):
+        return 2 + sum(estimate_size(key) + estimate_size(item) + 4
+                       for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 2 + sum(estimate_size(item) + 2 for item in value)
+    if value is None or value is True:
+        return 4
+    if value is False:
+        return 5
+    return len(repr(value))
+
+
+class Budget:
+
+    """
+    Limits on a builder, `None` meaning unlimited:
+
+    - `max_clauses`: query clauses, nested ones included (compare with
+      `indices.query.bool.max_clause_count`)
+    - `max_depth`: levels of nested builders, 1 for a flat builder
+    - `max_aggs`: aggregations, nested ones included
+    - `max_bytes`: estimated size of the JSON body
+
+    With `action='raise'` the call crossing a limit raises
+    `BudgetExceededError` and leaves the builder unchanged; with
+    `action='warn'` a `BudgetWarning` is issued once, when the limit is
+    crossed.
+    """
+
+    def __init__(self, max_clauses=None, max_depth=None, max_aggs=None,
+                 max_bytes=None, action='raise'):
+        if action not in ('raise', 'warn'):
+            raise ValueError("action should be 'raise' or 'warn'")
+        self.max_clauses = max_clauses
+        self.max_depth = max_depth
+        self.max_aggs = max_aggs
+        self.max_bytes = max_bytes
+        self.action = action
+
+    def check(self, before, after):
+        """
+        `before` and `after` are `(clauses, depth, aggs, bytes)` totals
+        """
+        limits = (self.max_clauses, self.max_depth, self.max_aggs,
+                  self.max_bytes)
+        names = ('clauses', 'depth', 'aggregations', 'estimated bytes')
+        for limit, name, old, new in zip(limits, names, before, after):
+            if limit is None or new <= limit or old > limit:
+                continue
+            message = f"Budget exceeded: {new} {name} > {limit}"
+            if self.action == 'raise':
+                raise BudgetExceededError(message)
+            warnings.warn(message, BudgetWarning,
+                          stacklevel=_caller_stacklevel())
+
+    def __repr__(self):
+        return (f"Budget(max_clauses={self.max_clauses!r}, "
+                f"max_depth={self.max_depth!r}, "
+                f"max_aggs={self.max_aggs!r}, "
+                f"max_bytes={self.max_bytes!r}, action={self.action!r})")
+
+
+def clause_usage(clause, is_aggregation):
+    """
+    `(clauses, depth, aggs, bytes)` added by registering `clause`
+    """
+    if isinstance(clause, ClauseGroup):
+        return _group_usage(clause)
+    nested = clause.nested
+    # volatile nested builders are only known at build time
+    if nested is None or isinstance(nested, Volatile):
+        nested_usage = (0, 0, 0, 0)
+    else:
+        nested_usage = (nested.clause_count, nested.depth,
+                        nested.aggregation_count, nested.estimated_size)
+    size = _CLAUSE_OVERHEAD + estimate_size(clause.type) + nested_usage[3]
+    if is_aggregation:
+        size += estimate_size(clause.name) + estimate_size(clause.field) + \
+            estimate_size(clause.options or {}) + _CLAUSE_OVERHEAD
+        return (nested_usage[0], nested_usage[1] + 1, nested_usage[2] + 1,
+                size)
+    if clause.options is not None:
+        size += estimate_size(clause.options)
+    if clause.field is not _NO_FIELD:
+        size += estimate_size(clause.field) + estimate_size(clause.value) + 4
+    return (nested_usage[0] + 1, nested_usage[1] + 1, nested_usage[2], size)
+
+
+def _group_usage(group):
+    count = len(group)
+    per_clause = 2 * _CLAUSE_OVERHEAD + estimate_size(group.type) + \
+        estimate_size(group.field) + 2
+    if group.options is not None:
+        per_clause += estimate_size(group.options)
+    if group.pairs:
+        per_clause += _RANGE_OVERHEAD
+    # the values are counted like a list, i.e. with a separator each
+    size = count * per_clause + estimate_size(group._plain_values())
+    return (count, 1, 0, size)
+
+
+def option_size(name, key, value):
+    """
+    Estimated bytes of an option in the body, 0 if it is not emitted
+    """
+    if name == 'sorts':
+        return estimate_size(key) + estimate_size(value) + _SORT_OVERHEAD
+    if name in ('rawOptions', 'misc'):
+        return estimate_size(key) + estimate_size(value) + 4
+    return 0
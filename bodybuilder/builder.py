@@ -1,8 +1,39 @@
 """
 Main Builder Class and functions
 """
+import marshal
 from collections import OrderedDict
 
+from . import pagination, profiling, serializer
+from .batching import batch_term_clauses
+from .budget import clause_usage, option_size
+from .clauses import (AggregationClause, ClauseGroup, QueryClause,
+                      iter_clauses, single_clause)
+from .decoder import AggregationDecoder
+from .dedupe import ClauseInterner
+from .optimizer import optimize_body
+from .parser import parse_body
+from .persistent import PersistentList
+from .profiling import hooks as _profiling_hooks
+from .template import Param, Template, _OptionalParam
+
+
+def _copy_nodes(node):
+    if isinstance(node, dict):
+        return {key: _copy_nodes(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_copy_nodes(value) for value in node]
+    return node
+
+
+def _copy_body(body):
+    # marshal copies plain JSON-like trees at C speed and refuses anything
+    # else (placeholders, dict subclasses, ...), which falls back to Python
+    try:
+        return marshal.loads(marshal.dumps(body))
+    except ValueError:
+        return _copy_nodes(body)
+
 
 class BodyBuilder:
 
@@ -10,135 +41,44 @@ class BodyBuilder:
     Builder Class which creates the queries
     """
 
-    def __init__(self):
-        self.queries = []
-        self.filters = []
-        self.orFilters = []
-        self.notFilters = []
-        self.aggs = []
+    def __init__(self, deduplicate=False, batch_terms=False,
+                 max_terms_count=65536, budget=None):
+        self.queries = PersistentList()
+        self.filters = PersistentList()
+        self.orFilters = PersistentList()
+        self.notFilters = PersistentList()
+        self.aggs = PersistentList()
         self.sorts = OrderedDict()
         self.misc = {}
         self.body = {}
         self.rawOptions = {}
         self.minimumShouldMatch = {}
-
-    def _add_bool_struct(self):
-        self.body['query'] = {
+        self._agg_names = set()
+        self._dirty = True
+        self._volatile = False
+        self._shared_options = False
+        self.deduplicate = deduplicate
+        self.duplicates_dropped = 0
+        self.batch_terms = batch_terms
+        self.max_terms_count = max_terms_count
+        self.budget = budget
+        self.clause_count = 0
+        self.depth = 1
+        self.aggregation_count = 0
+        self.estimated_size = 2
+
+    def _add_bool_struct(self, body):
+        body['query'] = {
             'bool': {}
         }
 
-    @staticmethod
-    def _add_nested_function_query(query_dict, nested_function, query_name):
-        if nested_function is None:
-            return query_dict
-        built_class = nested_function(BodyBuilder())
-        if len(built_class.filters) > 0:
-            nested_query = built_class.getFilter()
-            query_dict[query_name]['filter'] = nested_query
-        else:
-            nested_query = built_class.getQuery()
-            query_dict[query_name]['query'] = nested_query
-        return query_dict
-
-    @staticmethod
-    def _create_empty_query_dict(query_name):
-        return {
-            query_name: {}
-        }
-
-    @staticmethod
-    def _get_query_field_value(args_list):
-        if len(args_list) == 2:
-            query_field, query_val = 'field', args_list[1]
-        else:
-            query_field, query_val = args_list[1], args_list[2]
-        return query_field, query_val
-
     @staticmethod
     def create_generic_query(*args):
-        args_list = list(args)
-        query_name = args_list[0]
-        query_dict = BodyBuilder._create_empty_query_dict(query_name)
-
-        nested_function = args_list.pop() if callable(args_list[-1]) else None
-
-        if len(args_list) > 1:
-            query_dict = BodyBuilder.add_query_arguments(
-                args_list, query_dict, query_name)
-
-        query_dict = BodyBuilder._add_nested_function_query(
-            query_dict, nested_function, query_name)
-
-        return query_dict
-
-    @staticmethod
-    def add_query_arguments(args_list, query_dict, query_name):
-        query_field, query_val = BodyBuilder._get_query_field_value(args_list)
-        query_dict[query_name] = {
-            query_field: query_val
-        }
-        if len(args_list) == 4:
-            for key, value in args_list[3].items():
-                query_dict[args_list[0]][key] = value
-        if len(args_list) > 4:
-            raise IndexError("Too many arguments to query!")
-        return query_dict
-
-    @staticmethod
-    def _get_query_field_dict_aggs(args_list):
-        return {'field': args_list[1]} if type(args_list[1]) is str else {}
-
-    @staticmethod
-    def _get_aggs_options(args_list, query_field_dict):
-        additional_options = [x for x in args_list if type(x) is dict]
-        return {key: value for d in (additional_options + [query_field_dict])
-                for key, value in d.items()}
-
-    @staticmethod
-    def _get_aggs_query_name(args_list, query_field, query_type):
-        query_name_candidates = [x for x in args_list[2:] if type(x) is str]
-
-        if len(query_name_candidates) > 0:
-            query_name = query_name_candidates[0]
-        else:
-            if len(query_field) == 0:
-                raise ValueError("Query name should be provided \
-                                  if query field is empty")
-            query_name = f"agg_{query_type}_{list(query_field.values())[0]}"
-        return query_name
-
-    @staticmethod
-    def _add_nested_function_aggs(query_dict, nested_function, query_name):
-        if nested_function is None:
-            return query_dict
-        nested_aggs_query = nested_function(BodyBuilder()).getAggregations()
-        query_dict[query_name]['aggs'] = nested_aggs_query
-        return query_dict
+        return QueryClause.from_args(args, BodyBuilder).to_dict(BodyBuilder)
 
     @staticmethod
     def create_aggs_query(*args):
-
-        if len(args) <= 1:
-            raise IndexError("Too Few arguments for aggregation query")
-        args_list = list(args)
-
-        nested_function = args_list.pop() if callable(args_list[-1]) else None
-
-        query_type = args_list[0]
-        query_field = BodyBuilder._get_query_field_dict_aggs(args_list)
-        all_options = BodyBuilder._get_aggs_options(args_list, query_field)
-        query_name = BodyBuilder._get_aggs_query_name(args_list, query_field, query_type)  # noqa E501
-
-        query_dict = {
-            query_name: {
-                query_type: all_options
-            }
-        }
-
-        query_dict = BodyBuilder._add_nested_function_aggs(
-            query_dict, nested_function, query_name)
-
-        return query_dict
+        return AggregationClause.from_args(args, BodyBuilder).to_dict(BodyBuilder)
 
     @staticmethod
     def create_sort_query(sort_dict):
@@ -148,49 +88,56 @@ class BodyBuilder:
             }
         } for key, value in sort_dict.items()]
 
-    def _add_queries_simple(self):
-        self.body['query'] = self.create_generic_query(*self.queries[0])
+    def _add_queries_simple(self, body):
+        body['query'] = single_clause(self.queries).to_dict(self.__class__)
 
-    def _add_bool_queries(self, query_type, name):
-        if len(getattr(self, query_type)) == 0:
+    def _add_bool_queries(self, body, query_type, name, interner=None):
+        clauses = getattr(self, query_type)
+        if len(clauses) == 0:
             return
+        clauses = iter_clauses(clauses)
+        if self.batch_terms and query_type in ['orFilters', 'notFilters']:
+            clauses = batch_term_clauses(list(clauses), self.max_terms_count)
+        bool_list = [x.to_dict(self.__class__) for x in clauses]
+        if interner is not None:
+            bool_list = interner.dedupe(bool_list)
         always_array_types = ['orFilters', 'notFilters']
-        if len(getattr(self, query_type)) == 1 and query_type not in always_array_types:
-            bool_dict = self.create_generic_query(*getattr(self, query_type)[0])
-            self.body['query']['bool'][name] = bool_dict
+        if len(bool_list) == 1 and query_type not in always_array_types:
+            body['query']['bool'][name] = bool_list[0]
         else:
-            bool_list = [self.create_generic_query(*x) for x in getattr(self, query_type)]
-            self.body['query']['bool'][name] = bool_list
+            body['query']['bool'][name] = bool_list
 
-    def _add_aggs(self):
+    def _add_aggs(self, body):
         if len(self.aggs) == 0:
             return
-        if len(self.aggs) <= 1:
-            aggs_dict = self.create_aggs_query(*self.aggs[0])
-            self.body['aggs'] = aggs_dict
-        else:
-            raise NotImplementedError
+        aggs_dict = {}
+        for clause in self.aggs:
+            aggs_dict.update(clause.to_dict(self.__class__))
+        body['aggs'] = aggs_dict
 
-    def _add_sorts(self):
+    def _add_sorts(self, body):
         if len(self.sorts) == 0:
             return
         sort_dict_list = self.create_sort_query(self.sorts)
-        self.body['sort'] = sort_dict_list
+        body['sort'] = sort_dict_list
 
-    def _add_rawOptions(self):
+    def _add_rawOptions(self, body):
         for key, value in self.rawOptions.items():
-            self.body[key] = value
+            body[key] = value
 
-    def _add_misc(self):
-        if self.misc.get('from'):
-            self.body['from'] = self.misc.get('from')
-        if self.misc.get('size'):
-            self.body['size'] = self.misc.get('size')
+    def _add_misc(self, body):
+        for key in ('from', 'size'):
+            value = self.misc.get(key)
+            if isinstance(value, Param):
+                # left out of rendered bodies when falsy, like below
+                body[key] = _OptionalParam(value.name)
+            elif value:
+                body[key] = value
 
     ######################
 
     def is_simple_query(self):
-        if len(self.queries) != 1:
+        if single_clause(self.queries) is None:
             return False
         if len(self.filters) + len(self.orFilters) + len(self.notFilters) != 0:
             return False
@@ -206,77 +153,364 @@ class BodyBuilder:
             return True
         return False
 
+    def _charge(self, clauses, depth, aggregations, size):
+        usage = (self.clause_count + clauses, max(self.depth, depth),
+                 self.aggregation_count + aggregations,
+                 self.estimated_size + size)
+        if self.budget is not None:
+            self.budget.check((self.clause_count, self.depth,
+                               self.aggregation_count, self.estimated_size),
+                              usage)
+        self.clause_count, self.depth, self.aggregation_count, \
+            self.estimated_size = usage
+
+    def _add_clause(self, name, clause_class, args):
+        self._append_clause(name, clause_class.from_args(args, self.__class__))
+
+    def _append_clause(self, name, clause):
+        if name == 'aggs' and clause.name in self._agg_names:
+            raise ValueError(f"Duplicate aggregation name {clause.name!r}")
+        self._charge(*clause_usage(clause,
+                                   isinstance(clause, AggregationClause)))
+        if name == 'aggs':
+            if self._shared_options:
+                self._unshare_options()
+            self._agg_names.add(clause.name)
+        setattr(self, name, getattr(self, name).appended(clause))
+        self._volatile = self._volatile or clause.is_volatile()
+        self._dirty = True
+
+    def _unshare_options(self):
+        self.sorts = OrderedDict(self.sorts)
+        self.misc = dict(self.misc)
+        self.rawOptions = dict(self.rawOptions)
+        self.minimumShouldMatch = dict(self.minimumShouldMatch)
+        self._agg_names = set(self._agg_names)
+        self._shared_options = False
+
+    def _set_option(self, name, key, value):
+        options = getattr(self, name)
+        if key in options and options[key] is value:
+            return
+        size = option_size(name, key, value)
+        if key in options:
+            size -= option_size(name, key, options[key])
+        self._charge(0, 0, 0, size)
+        if self._shared_options:
+            self._unshare_options()
+            options = getattr(self, name)
+        options[key] = value
+        self._dirty = True
+
     def query(self, *args):
-        self.queries.append(args)
+        self._add_clause('queries', QueryClause, args)
         return self
 
     def filter(self, *args):
-        self.filters.append(args)
+        self._add_clause('filters', QueryClause, args)
         return self
 
     def orFilter(self, *args):
-        self.orFilters.append(args)
+        self._add_clause('orFilters', QueryClause, args)
         return self
 
     def notFilter(self, *args):
-        self.notFilters.append(args)
+        self._add_clause('notFilters', QueryClause, args)
         return self
 
     def aggregation(self, *args):
-        self.aggs.append(args)
+        self._add_clause('aggs', AggregationClause, args)
+        return self
+
+    def _add_group(self, name, query_type, field, values, options):
+        group = ClauseGroup(query_type, field, values, options)
+        if len(group) > 0:
+            self._append_clause(name, group)
+
+    def query_many(self, query_type, field, values, options=None):
+        """
+        Same as calling `query(query_type, field, value, options)` for every
+        value, registered as one compact group. For `range`, the values are
+        `(gte, lt)` pairs. NumPy arrays and other objects with a `tolist()`
+        method are kept as they are until the body is built.
+        """
+        self._add_group('queries', query_type, field, values, options)
+        return self
+
+    def filter_many(self, query_type, field, values, options=None):
+        self._add_group('filters', query_type, field, values, options)
+        return self
+
+    def orFilter_many(self, query_type, field, values, options=None):
+        self._add_group('orFilters', query_type, field, values, options)
+        return self
+
+    def notFilter_many(self, query_type, field, values, options=None):
+        self._add_group('notFilters', query_type, field, values, options)
         return self
 
     def sort(self, *args):
         if len(args) > 2:
             raise ValueError
         sort_type = 'asc' if len(args) == 1 else args[1]
-        self.sorts[args[0]] = sort_type
+        self._set_option('sorts', args[0], sort_type)
         return self
 
     def from_(self, value):
-        self.misc['from'] = value
+        self._set_option('misc', 'from', value)
         return self
 
     def size(self, value):
-        self.misc['size'] = value
+        self._set_option('misc', 'size', value)
         return self
 
     def getQuery(self):
-        return self.build()['query']
+        return _copy_body(self._build_cached()['query'])
 
     def getFilter(self):
-        return self.build()['query']['bool']['filter']
+        return _copy_body(self._build_cached()['query']['bool']['filter'])
 
     def getAggregations(self):
-        return self.build()['aggs']
+        return _copy_body(self._build_cached()['aggs'])
 
     def rawOption(self, key, value):
-        self.rawOptions[key] = value
+        self._set_option('rawOptions', key, value)
         return self
 
     def queryMinimumShouldMatch(self, value):
-        self.minimumShouldMatch['query'] = value
+        self._set_option('minimumShouldMatch', 'query', value)
         return self
 
     def filterMinimumShouldMatch(self, value):
-        self.minimumShouldMatch['filter'] = value
+        self._set_option('minimumShouldMatch', 'filter', value)
         return self
 
-    def add_query_details(self):
+    def add_query_details(self, body=None):
+        if body is None:
+            # the published body may be shared with clones and frozen
+            # builders, so it is rebuilt and published again, never updated
+            self._dirty = True
+            self._build_cached()
+            return
         if self.is_simple_query():
-            self._add_queries_simple()
+            self._add_queries_simple(body)
         else:
-            self._add_bool_struct()
-            self._add_bool_queries('queries', 'must')
-            self._add_bool_queries('filters', 'filter')
-            self._add_bool_queries('orFilters', 'should')
-            self._add_bool_queries('notFilters', 'must_not')
-
-    def build(self):
+            interner = ClauseInterner() if self.deduplicate else None
+            self._add_bool_struct(body)
+            self._add_bool_queries(body, 'queries', 'must', interner)
+            self._add_bool_queries(body, 'filters', 'filter', interner)
+            self._add_bool_queries(body, 'orFilters', 'should', interner)
+            self._add_bool_queries(body, 'notFilters', 'must_not', interner)
+            if interner is not None:
+                self.duplicates_dropped = interner.dropped
+
+    def clone(self):
+        """
+        Fork the builder in O(1). The clause lists are shared with the
+        original and the options are copied the first time either side
+        changes them, so changes to the clone never leak into the original.
+        """
+        clone = self.__class__.__new__(self.__class__)
+        clone.__dict__.update(self.__dict__)
+        self._shared_options = clone._shared_options = True
+        return clone
+
+    @classmethod
+    def from_body(cls, body, **kwargs):
+        """
+        Builder whose `build()` gives `body` back, e.g. to extend a stored
+        query. `kwargs` are passed to the constructor.
+        """
+        return parse_body(cls(**kwargs), _copy_body(body))
+
+    def freeze(self):
+        """
+        Immutable snapshot of the builder, with its body built up front so
+        that any number of threads can build it without locks
+        """
+        return FrozenBodyBuilder(self)
+
+    def compile(self):
+        return Template(self.build())
+
+    def aggregation_decoder(self):
+        """
+        Compiled decoder turning the aggregations of a response to this
+        body into flat columns
+        """
+        return AggregationDecoder(self)
+
+    def iter_hits(self, search, tiebreaker=None, pit=None, keep_alive='1m',
+                  prefetch=True):
+        """
+        Stream every hit of the search with `search_after` cursors, `search`
+        being a callable sending a body and returning the response. See
+        `bodybuilder.pagination`.
+        """
+        return pagination.iter_hits(self, search, tiebreaker, pit,
+                                    keep_alive, prefetch)
+
+    def _build_cached(self):
+        if not self._dirty and not self._volatile:
+            return self.body
+        # the body is filled in locally and only published once complete, so
+        # builds running concurrently never see each other's partial bodies
+        body = {}
+        self.duplicates_dropped = 0
+        if _profiling_hooks:
+            profiling.run_profiled(self, self._build_steps(body))
+        else:
+            if self.query_exists():
+                self.add_query_details(body)
+            self._add_sorts(body)
+            self._add_rawOptions(body)
+            self._add_misc(body)
+            self._add_aggs(body)
+        self.body = body
+        self._dirty = False
+        return body
+
+    def _add_query_if_exists(self, body):
         if self.query_exists():
-            self.add_query_details()
-        self._add_sorts()
-        self._add_rawOptions()
-        self._add_misc()
-        self._add_aggs()
-        return self.body
+            self.add_query_details(body)
+
+    def _build_steps(self, body):
+        return [
+            ('add_query_details', lambda: self._add_query_if_exists(body)),
+            ('_add_sorts', lambda: self._add_sorts(body)),
+            ('_add_rawOptions', lambda: self._add_rawOptions(body)),
+            ('_add_misc', lambda: self._add_misc(body)),
+            ('_add_aggs', lambda: self._add_aggs(body)),
+        ]
+
+    def build(self, optimize=False):
+        if optimize:
+            return _copy_body(optimize_body(self._build_cached()))
+        return _copy_body(self._build_cached())
+
+    def build_json(self):
+        return serializer.dumps(self)
+
+    def build_bytes(self):
+        return self.build_json().encode('utf-8')
+
+    def iter_json(self, chunk_size=65536):
+        """
+        Yield the JSON encoding of the body in chunks of about `chunk_size`
+        characters, without building the whole body in memory
+        """
+        return serializer.iter_chunks(self, chunk_size)
+
+    def iter_bytes(self, chunk_size=65536):
+        for chunk in self.iter_json(chunk_size):
+            yield chunk.encode('utf-8')
+
+
+class FrozenBodyBuilder(BodyBuilder):
+
+    """
+    Immutable builder, returned by `BodyBuilder.freeze()`
+
+    Every chain method returns a new `FrozenBodyBuilder` and leaves the
+    original untouched. The clause lists are persistent, so the new builder
+    shares them with the original and a chain call stays O(1), which makes
+    frozen builders safe to keep as a library of partial queries and to
+    build from any number of threads.
+
+        BASE = BodyBuilder().filter('term', 'tenant', 'a').freeze()
+        kimchy = BASE.filter('term', 'user', 'kimchy')  # BASE is unchanged
+    """
+
+    def __init__(self, builder=None):
+        builder = BodyBuilder() if builder is None else builder
+        self._adopt(builder.clone())
+        # freezing an existing builder builds its body up front, the bodies
+        # of chained builders are built on first use
+        self._build_cached()
+
+    def _adopt(self, builder):
+        if builder._volatile:
+            raise ValueError("A builder with Volatile nested lambdas is "
+                             "rebuilt on every build and cannot be frozen")
+        self.__dict__.update(builder.__dict__)
+
+    def _chain(self, method, *args):
+        builder = self.thaw()
+        method(builder, *args)
+        frozen = FrozenBodyBuilder.__new__(FrozenBodyBuilder)
+        frozen._adopt(builder)
+        return frozen
+
+    def _add_clause(self, name, clause_class, args):
+        raise TypeError("FrozenBodyBuilder is immutable")
+
+    def _set_option(self, name, key, value):
+        raise TypeError("FrozenBodyBuilder is immutable")
+
+    def query(self, *args):
+        return self._chain(BodyBuilder.query, *args)
+
+    def filter(self, *args):
+        return self._chain(BodyBuilder.filter, *args)
+
+    def orFilter(self, *args):
+        return self._chain(BodyBuilder.orFilter, *args)
+
+    def notFilter(self, *args):
+        return self._chain(BodyBuilder.notFilter, *args)
+
+    def aggregation(self, *args):
+        return self._chain(BodyBuilder.aggregation, *args)
+
+    def query_many(self, query_type, field, values, options=None):
+        return self._chain(BodyBuilder.query_many, query_type, field,
+                           values, options)
+
+    def filter_many(self, query_type, field, values, options=None):
+        return self._chain(BodyBuilder.filter_many, query_type, field,
+                           values, options)
+
+    def orFilter_many(self, query_type, field, values, options=None):
+        return self._chain(BodyBuilder.orFilter_many, query_type, field,
+                           values, options)
+
+    def notFilter_many(self, query_type, field, values, options=None):
+        return self._chain(BodyBuilder.notFilter_many, query_type, field,
+                           values, options)
+
+    def sort(self, *args):
+        return self._chain(BodyBuilder.sort, *args)
+
+    def from_(self, value):
+        return self._chain(BodyBuilder.from_, value)
+
+    def size(self, value):
+        return self._chain(BodyBuilder.size, value)
+
+    def rawOption(self, key, value):
+        return self._chain(BodyBuilder.rawOption, key, value)
+
+    def queryMinimumShouldMatch(self, value):
+        return self._chain(BodyBuilder.queryMinimumShouldMatch, value)
+
+    def filterMinimumShouldMatch(self, value):
+        return self._chain(BodyBuilder.filterMinimumShouldMatch, value)
+
+    @classmethod
+    def from_body(cls, body, **kwargs):
+        return BodyBuilder.from_body(body, **kwargs).freeze()
+
+    def clone(self):
+        return self
+
+    def freeze(self):
+        return self
+
+    def thaw(self):
+        """
+        Mutable `BodyBuilder` forked from this one in O(1)
+        """
+        builder = BodyBuilder.__new__(BodyBuilder)
+        builder.__dict__.update(self.__dict__)
+        builder._shared_options = True
+        return builder
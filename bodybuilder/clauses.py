@@ -0,0 +1,274 @@
+"""
+Parsed representation of the clauses registered on a builder
+
+The `*args` of `query()`/`filter()`/`aggregation()` are inspected once, when
+the clause is registered, so that building only has to emit the result.
+Nested lambdas are run once at registration as well and the resolved builder
+is kept on the clause, unless they are wrapped in `Volatile`. A builder can
+also be passed directly in place of the lambda, which keeps the clause
+picklable.
+"""
+import copy
+
+_NO_FIELD = object()
+
+
+class Volatile:
+
+    """
+    Marks a nested lambda which has to be re-run on every build, e.g. because
+    it reads state which changes between builds
+    """
+
+    __slots__ = ('function',)
+
+    def __init__(self, function):
+        self.function = function
+
+    def __call__(self, builder):
+        return self.function(builder)
+
+
+def _pop_nested(args_list, builder_class):
+    last = args_list[-1]
+    if callable(last) or isinstance(last, builder_class):
+        return args_list.pop()
+    return None
+
+
+def _checked_nested(built, builder_class):
+    # e.g. a nested function which forgot to return its builder, whose
+    # clause would otherwise silently match more documents
+    if not isinstance(built, builder_class):
+        raise TypeError(f"Nested functions should return a "
+                        f"{builder_class.__name__}, not {built!r}")
+    return built
+
+
+def _resolve_nested(nested, builder_class):
+    if nested is None or isinstance(nested, Volatile):
+        return nested
+    if isinstance(nested, builder_class):
+        # later changes to the caller's builder must not leak into the clause
+        return nested.clone()
+    return _checked_nested(nested(builder_class()), builder_class)
+
+
+class _Clause:
+
+    __slots__ = ()
+
+    def is_volatile(self):
+        if isinstance(self.nested, Volatile):
+            return True
+        return self.nested is not None and self.nested._volatile
+
+    def nested_builder(self, builder_class):
+        if isinstance(self.nested, Volatile):
+            return _checked_nested(self.nested(builder_class()),
+                                   builder_class)
+        return self.nested
+
+
+class QueryClause(_Clause):
+
+    """
+    A query or filter clause, e.g. `('range', 'count', {'gt': 5})`
+    """
+
+    __slots__ = ('type', 'field', 'value', 'options', 'nested')
+
+    def __init__(self, query_type, field=_NO_FIELD, value=None,
+                 options=None, nested=None):
+        self.type = query_type
+        self.field = field
+        self.value = value
+        self.options = options
+        self.nested = nested
+
+    @classmethod
+    def from_args(cls, args, builder_class):
+        args_list = list(args)
+        nested = _pop_nested(args_list, builder_class)
+        if len(args_list) > 4:
+            raise IndexError("Too many arguments to query!")
+        nested = _resolve_nested(nested, builder_class)
+        if len(args_list) == 1:
+            return cls(args_list[0], nested=nested)
+        if len(args_list) == 2:
+            return cls(args_list[0], 'field', args_list[1], nested=nested)
+        options = args_list[3] if len(args_list) == 4 else None
+        return cls(args_list[0], args_list[1], args_list[2], options, nested)
+
+    def inner(self):
+        """
+        Body of the clause without the nested subquery
+        """
+        inner = {}
+        if self.field is not _NO_FIELD:
+            inner[self.field] = self.value
+        if self.options is not None:
+            for key, value in self.options.items():
+                inner[key] = value
+        return inner
+
+    def to_dict(self, builder_class):
+        inner = self.inner()
+        if self.nested is not None:
+            built_class = self.nested_builder(builder_class)
+            body = built_class._build_cached()
+            if len(built_class.filters) > 0:
+                inner['filter'] = body['query']['bool']['filter']
+            else:
+                inner['query'] = body['query']
+        return {self.type: inner}
+
+
+class ClauseGroup(_Clause):
+
+    """
+    Clauses of one type on one field registered in bulk by `filter_many()`
+    and friends. The values are kept in a single list (or a copy of the
+    array they were given as) and only turned into clauses when the body is
+    built or serialized. `range` groups take `(gte, lt)` pairs, kept as one
+    flat list, and leave out `None` bounds.
+    """
+
+    __slots__ = ('type', 'field', 'values', 'options', 'pairs', 'count',
+                 'nested')
+
+    def __init__(self, query_type, field, values, options=None):
+        self.type = query_type
+        self.field = field
+        self.options = options
+        self.pairs = query_type == 'range'
+        self.nested = None
+        if hasattr(values, 'tolist'):
+            # NumPy and array.array: keep the compact array, copied so that
+            # later changes by the caller do not leak in
+            self.values = copy.copy(values)
+            flat = getattr(values, 'ndim', 1) == 1
+            self.count = len(values) // 2 if self.pairs and flat \
+                else len(values)
+        elif self.pairs:
+            self.values = [bound for pair in values for bound in pair]
+            self.count = len(self.values) // 2
+        else:
+            self.values = list(values)
+            self.count = len(self.values)
+
+    def _plain_values(self):
+        if hasattr(self.values, 'tolist'):
+            values = self.values.tolist()
+            if self.pairs and values and isinstance(values[0], list):
+                return [bound for pair in values for bound in pair]
+            return values
+        return self.values
+
+    def __len__(self):
+        return self.count
+
+    def expand(self):
+        """
+        Yield the `QueryClause` of every value
+        """
+        values = self._plain_values()
+        if not self.pairs:
+            for value in values:
+                yield QueryClause(self.type, self.field, value, self.options)
+            return
+        bounds = iter(values)
+        for gte, lt in zip(bounds, bounds):
+            value = {}
+            if gte is not None:
+                value['gte'] = gte
+            if lt is not None:
+                value['lt'] = lt
+            yield QueryClause(self.type, self.field, value, self.options)
+
+
+def iter_clauses(clauses):
+    """
+    The clauses of a clause list, with the groups expanded
+    """
+    for clause in clauses:
+        if isinstance(clause, ClauseGroup):
+            yield from clause.expand()
+        else:
+            yield clause
+
+
+def single_clause(clauses):
+    """
+    The only clause of a clause list once its groups are expanded, else None
+    """
+    if len(clauses) != 1:
+        return None
+    clause = clauses[0]
+    if isinstance(clause, ClauseGroup):
+        if len(clause) != 1:
+            return None
+        clause, = clause.expand()
+    return clause
+
+
+def _get_aggs_query_name(args_list, field, query_type):
+    query_name_candidates = [x for x in args_list[2:] if type(x) is str]
+
+    if len(query_name_candidates) > 0:
+        return query_name_candidates[0]
+    if field is None:
+        raise ValueError("Query name should be provided \
+                          if query field is empty")
+    return f"agg_{query_type}_{field}"
+
+
+class AggregationClause(_Clause):
+
+    """
+    An aggregation, e.g. `('percentiles', 'load_time', {'percents': [1]})`
+    """
+
+    __slots__ = ('type', 'name', 'field', 'options', 'nested')
+
+    def __init__(self, query_type, name, field=None, options=None,
+                 nested=None):
+        self.type = query_type
+        self.name = name
+        self.field = field
+        self.options = options
+        self.nested = nested
+
+    @classmethod
+    def from_args(cls, args, builder_class):
+        if len(args) <= 1:
+            raise IndexError("Too Few arguments for aggregation query")
+        args_list = list(args)
+        nested = _pop_nested(args_list, builder_class)
+
+        query_type = args_list[0]
+        field = args_list[1] if type(args_list[1]) is str else None
+        additional_options = [x for x in args_list if type(x) is dict]
+        if len(additional_options) == 0:
+            options = None
+        elif len(additional_options) == 1:
+            options = additional_options[0]
+        else:
+            options = {key: value for d in additional_options
+                       for key, value in d.items()}
+        name = _get_aggs_query_name(args_list, field, query_type)
+        nested = _resolve_nested(nested, builder_class)
+        return cls(query_type, name, field, options, nested)
+
+    def all_options(self):
+        all_options = {} if self.options is None else dict(self.options)
+        if self.field is not None:
+            all_options['field'] = self.field
+        return all_options
+
+    def to_dict(self, builder_class):
+        aggs_dict = {self.type: self.all_options()}
+        if self.nested is not None:
+            built_class = self.nested_builder(builder_class)
+            aggs_dict['aggs'] = built_class._build_cached()['aggs']
+        return {self.name: aggs_dict}
@@ -0,0 +1,225 @@
+"""
+Columnar decoding of aggregation responses
+
+The aggregation tree of a builder is compiled once into a Python function
+which walks a response in a single pass and appends every bucket to flat
+columns. There is one table per bucket aggregation, keyed by its bucket path
+(`'agg_terms_user>agg_date_histogram_timestamp'`, `''` for top level
+metrics), with:
+
+- one key column per bucket level, named after the aggregation
+- `doc_count` of the bucket
+- one column per metric of the bucket, `name.sub` for multi-value metrics
+  (`stats`, `percentiles`, ...)
+
+Columns are lists, or `array.array`/NumPy arrays with `columns='array'` /
+`columns='numpy'`.
+"""
+import array
+import math
+
+_SINGLE_BUCKET_TYPES = {
+    'filter', 'nested', 'reverse_nested', 'global', 'sampler',
+    'diversified_sampler', 'children', 'parent', 'missing',
+}
+_MULTI_BUCKET_TYPES = {
+    'terms', 'rare_terms', 'significant_terms', 'multi_terms', 'histogram',
+    'date_histogram', 'auto_date_histogram', 'variable_width_histogram',
+    'range', 'date_range', 'ip_range', 'filters', 'adjacency_matrix',
+    'composite', 'geohash_grid', 'geotile_grid',
+}
+_STATS = {
+    'stats': ['count', 'min', 'max', 'avg', 'sum'],
+    'extended_stats': ['count', 'min', 'max', 'avg', 'sum', 'sum_of_squares',
+                       'variance', 'std_deviation'],
+}
+_DEFAULT_PERCENTS = [1, 5, 25, 50, 75, 95, 99]
+_RAW_TYPES = {'top_hits', 'top_metrics', 'geo_bounds', 'geo_centroid',
+              'scripted_metric', 'matrix_stats', 'string_stats',
+              'boxplot'}
+
+
+def _buckets(agg):
+    """
+    `(key, bucket)` pairs of a bucket aggregation in a response
+    """
+    buckets = agg.get('buckets')
+    if buckets is None:
+        # single bucket aggregations carry their bucket inline
+        return ((None, agg),)
+    if isinstance(buckets, dict):
+        return buckets.items()
+    return ((bucket.get('key'), bucket) for bucket in buckets)
+
+
+def _metric_columns(clause):
+    """
+    `(column name, keys)` of a metric, `keys` being the path to its value
+    """
+    options = clause.options or {}
+    if clause.type in _STATS:
+        return [(f"{clause.name}.{key}", (key,))
+                for key in _STATS[clause.type]]
+    if clause.type == 'percentiles':
+        percents = options.get('percents', _DEFAULT_PERCENTS)
+        return [(f"{clause.name}.{float(p)}", ('values', str(float(p))))
+                for p in percents]
+    if clause.type == 'percentile_ranks':
+        return [(f"{clause.name}.{float(v)}", ('values', str(float(v))))
+                for v in options.get('values', [])]
+    if clause.type in _RAW_TYPES:
+        return [(clause.name, ())]
+    return [(clause.name, ('value',))]
+
+
+def _get(node, keys):
+    for key in keys:
+        if node is None:
+            return None
+        node = node.get(key)
+    return node
+
+
+class _Codegen:
+
+    def __init__(self, builder_class):
+        self.builder_class = builder_class
+        self.lines = []
+        self.tables = {}
+        self.columns = 0
+        self.names = 0
+
+    def column(self, table, name):
+        variable = f"c{self.columns}"
+        self.columns += 1
+        table[name] = variable
+        return variable
+
+    def name(self, prefix):
+        self.names += 1
+        return f"{prefix}{self.names}"
+
+    def emit(self, indent, line):
+        self.lines.append('    ' * indent + line)
+
+    def emit_metrics(self, indent, table, node, clauses):
+        for clause in clauses:
+            metric = self.name('m')
+            self.emit(indent, f"{metric} = {node}.get({clause.name!r})")
+            for column, keys in _metric_columns(clause):
+                variable = self.column(table, column)
+                if len(keys) == 1:
+                    value = f"None if {metric} is None else " \
+                        f"{metric}.get({keys[0]!r})"
+                else:
+                    value = f"_get({metric}, {keys!r})"
+                self.emit(indent, f"{variable}.append({value})")
+
+    def emit_level(self, indent, node, clauses, path, keys):
+        """
+        Emit the loops over the bucket aggregations in `clauses`, which are
+        read from the response node `node`
+        """
+        for clause in clauses:
+            if not self.is_bucket(clause):
+                continue
+            level_path = path + [clause.name]
+            agg, key, bucket = (self.name('a'), self.name('k'),
+                                self.name('b'))
+            table = self.tables['>'.join(level_path)] = {}
+            level_keys = keys
+            if clause.type not in _SINGLE_BUCKET_TYPES:
+                level_keys = keys + [(clause.name, key)]
+
+            self.emit(indent, f"{agg} = {node}.get({clause.name!r})")
+            self.emit(indent, f"if {agg} is not None:")
+            self.emit(indent + 1, f"for {key}, {bucket} in _buckets({agg}):")
+            for column, variable in level_keys:
+                self.emit(indent + 2,
+                          f"{self.column(table, column)}.append({variable})")
+            self.emit(indent + 2, f"{self.column(table, 'doc_count')}"
+                                  f".append({bucket}.get('doc_count'))")
+            children = self.children(clause)
+            self.emit_metrics(indent + 2, table, bucket,
+                              [child for child in children
+                               if not self.is_bucket(child)])
+            self.emit_level(indent + 2, bucket, children, level_path,
+                            level_keys)
+
+    def children(self, clause):
+        if clause.nested is None:
+            return []
+        return list(clause.nested_builder(self.builder_class).aggs)
+
+    def is_bucket(self, clause):
+        return clause.nested is not None or \
+            clause.type in _SINGLE_BUCKET_TYPES or \
+            clause.type in _MULTI_BUCKET_TYPES
+
+    def compile(self, clauses):
+        metrics = [clause for clause in clauses if not self.is_bucket(clause)]
+        if metrics:
+            self.emit_metrics(1, self.tables.setdefault('', {}), 'aggs',
+                              metrics)
+        self.emit_level(1, 'aggs', clauses, [], [])
+
+        declarations = [f"    {variable} = []"
+                        for table in self.tables.values()
+                        for variable in table.values()]
+        tables = ', '.join(
+            f"{path!r}: {{" + ', '.join(
+                f"{column!r}: {variable}"
+                for column, variable in table.items()) + "}"
+            for path, table in self.tables.items())
+        return '\n'.join(['def decode(aggs):'] + declarations + self.lines +
+                         [f"    return {{{tables}}}"])
+
+
+def _as_array(values):
+    for typecode in ('q', 'd'):
+        try:
+            return array.array(typecode, values)
+        except (TypeError, OverflowError):
+            pass
+    if all(value is None or isinstance(value, (int, float))
+           for value in values):
+        return array.array('d', [math.nan if value is None else value
+                                 for value in values])
+    return values
+
+
+class AggregationDecoder:
+
+    """
+    Decoder of the aggregations of the responses to one builder's body,
+    returned by `BodyBuilder.aggregation_decoder()`
+    """
+
+    def __init__(self, builder):
+        codegen = _Codegen(builder.__class__)
+        self.source = codegen.compile(list(builder.aggs))
+        self.tables = {path: list(table)
+                       for path, table in codegen.tables.items()}
+        namespace = {'_buckets': _buckets, '_get': _get}
+        exec(compile(self.source, '<bodybuilder decoder>', 'exec'), namespace)
+        self._decode = namespace['decode']
+
+    def decode(self, response, columns='list'):
+        """
+        `{bucket path: {column: values}}` of a search response (or of its
+        `aggregations`)
+        """
+        aggs = response.get('aggregations', response)
+        tables = self._decode(aggs)
+        if columns == 'list':
+            return tables
+        if columns == 'array':
+            convert = _as_array
+        elif columns == 'numpy':
+            import numpy
+            convert = numpy.asarray
+        else:
+            raise ValueError("columns should be 'list', 'array' or 'numpy'")
+        return {path: {column: convert(values)
+                       for column, values in table.items()}
+                for path, table in tables.items()}
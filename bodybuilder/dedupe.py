@@ -0,0 +1,45 @@
+"""
+Deduplication of identical clauses in a bool query
+"""
+
+
+def freeze(node):
+    """
+    Hashable key which is equal for equal JSON-like trees, regardless of the
+    key order of their dicts. Leaves are tagged with their type, since `1`,
+    `1.0` and `True` are equal in Python but not in JSON.
+    """
+    if isinstance(node, dict):
+        return ('dict', frozenset((key, freeze(value))
+                                  for key, value in node.items()))
+    if isinstance(node, (list, tuple)):
+        return ('list', tuple(freeze(value) for value in node))
+    try:
+        hash(node)
+    except TypeError:
+        return ('id', id(node))
+    return (type(node), node)
+
+
+class ClauseInterner:
+
+    """
+    Drops the repeated clauses of each clause list while building a body and
+    counts them. Clauses are not shared between lists, so that every part of
+    the built body stays a separate object.
+    """
+
+    def __init__(self):
+        self.dropped = 0
+
+    def dedupe(self, clauses):
+        seen = set()
+        unique = []
+        for clause in clauses:
+            key = freeze(clause)
+            if key in seen:
+                self.dropped += 1
+                continue
+            seen.add(key)
+            unique.append(clause)
+        return unique
@@ -0,0 +1,118 @@
+"""
+Sliced parallel export of every hit of a search
+
+The body is split into `slices` sliced searches (`slice: {id, max}` added
+with `rawOption` to a clone of the builder per slice), which are paged with
+`search_after` concurrently, one thread per slice, and merged into a single
+stream of hits as pages arrive:
+
+    with open('tweets.ndjson', 'wb') as fp:
+        write_export(builder, search, fp, slices=8, pit=pit_id)
+
+Sliced searches need a point in time (`pit`), which every slice pages
+through, and at least 2 slices. Each slice holds at most `pages_per_slice`
+pages not yet consumed, so memory is bounded whatever the size of the index.
+Hits of one slice keep their sort order, hits of different slices are
+interleaved.
+"""
+import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .pagination import _iter_hits, iter_pages
+
+_DONE = object()
+
+
+def slice_builders(builder, slices):
+    """
+    Clones of `builder`, one per slice
+    """
+    return [builder.clone().rawOption('slice', {'id': i, 'max': slices})
+            for i in range(slices)]
+
+
+def iter_export_pages(builder, search, slices=4, tiebreaker=None, pit=None,
+                      keep_alive='1m', pages_per_slice=2):
+    """
+    Iterator over the hit lists of every page of every slice, as they arrive
+    """
+    if pit is None:
+        raise ValueError("A sliced export needs a point in time (pit)")
+    if slices < 2:
+        raise ValueError("A sliced export needs at least 2 slices")
+    return _drain_slices(builder, search, slices, tiebreaker, pit, keep_alive,
+                         pages_per_slice)
+
+
+def _drain_slices(builder, search, slices, tiebreaker, pit, keep_alive,
+                  pages_per_slice):
+    pages = queue.Queue()
+    slots = [threading.Semaphore(pages_per_slice) for _ in range(slices)]
+    stop = threading.Event()
+
+    def drain(index, sliced):
+        slice_pages = iter_pages(sliced, search, tiebreaker, pit, keep_alive,
+                                 prefetch=False)
+        try:
+            while True:
+                # wait for the consumer to take one of this slice's pages
+                slots[index].acquire()
+                if stop.is_set():
+                    return
+                hits = next(slice_pages, None)
+                if hits is None:
+                    break
+                pages.put((index, hits))
+        except BaseException as error:
+            pages.put((index, error))
+            return
+        finally:
+            slice_pages.close()
+        pages.put((index, _DONE))
+
+    executor = ThreadPoolExecutor(max_workers=slices)
+    try:
+        for index, sliced in enumerate(slice_builders(builder, slices)):
+            executor.submit(drain, index, sliced)
+        running = slices
+        while running:
+            index, hits = pages.get()
+            if hits is _DONE:
+                running -= 1
+                continue
+            if isinstance(hits, BaseException):
+                raise hits
+            slots[index].release()
+            yield hits
+    finally:
+        stop.set()
+        for slot in slots:
+            slot.release()
+        executor.shutdown(wait=True)
+
+
+def iter_export(builder, search, slices=4, tiebreaker=None, pit=None,
+                keep_alive='1m', pages_per_slice=2):
+    """
+    Iterator over every hit of `builder`'s search, drained by `slices`
+    parallel sliced searches
+    """
+    return _iter_hits(iter_export_pages(builder, search, slices, tiebreaker,
+                                        pit, keep_alive, pages_per_slice))
+
+
+def write_export(builder, search, fp, slices=4, tiebreaker=None, pit=None,
+                 keep_alive='1m', pages_per_slice=2):
+    """
+    Write every hit as a line of JSON to the binary file-like `fp` and return
+    the number of hits written
+    """
+    written = 0
+    for hits in iter_export_pages(builder, search, slices, tiebreaker, pit,
+                                  keep_alive, pages_per_slice):
+        fp.write(b''.join(json.dumps(hit).encode('utf-8') + b'\n'
+                          for hit in hits))
+        written += len(hits)
+    return written
@@ -0,0 +1,54 @@
+"""
+Multi-search (`_msearch`) NDJSON body generation
+"""
+import json
+
+from .builder import BodyBuilder
+
+
+def _encode_body(body):
+    if isinstance(body, BodyBuilder):
+        return body.build_bytes()
+    return json.dumps(body).encode('utf-8')
+
+
+def _encode_header(header):
+    return json.dumps({} if header is None else header).encode('utf-8')
+
+
+def iter_msearch(searches, header=None):
+    """
+    Lazily yield the NDJSON lines of an `_msearch` request
+
+    Each search is a builder, an already built body or a `(header, body)`
+    pair overriding the default `header`
+    """
+    default_header = _encode_header(header) + b'\n'
+    for search in searches:
+        if isinstance(search, tuple):
+            search_header, body = search
+            yield _encode_header(search_header) + b'\n'
+        else:
+            body = search
+            yield default_header
+        yield _encode_body(body) + b'\n'
+
+
+def iter_msearch_template(template, param_sets, header=None):
+    """
+    `iter_msearch` for one compiled template rendered with each parameter set
+    """
+    return iter_msearch((template.render(**params) for params in param_sets),
+                        header)
+
+
+def write_msearch(searches, fp, header=None):
+    """
+    Write the `_msearch` request for `searches` to the binary file-like `fp`
+    and return the number of bytes written
+    """
+    written = 0
+    for line in iter_msearch(searches, header):
+        fp.write(line)
+        written += len(line)
+    return written
@@ -0,0 +1,173 @@
+"""
+Query tree optimizer run by `build(optimize=True)`
+
+Every rewrite keeps the set of matching documents and, where scores are
+used, the scores:
+
+- empty clause lists are dropped
+- `bool`s which are only a conjunction (`must`/`filter`/`must_not`) are
+  flattened into the `must`/`filter` of their parent
+- a `bool` with a single `must` clause (or a single `filter` clause where
+  scores are not used) is replaced by that clause
+- where scores are not used (sorted on fields only or no hits, and no
+  aggregations, `rescore` or `collapse`), `must` clauses become cacheable
+  `filter` clauses and empty `bool`s (match all) are dropped from `filter`
+"""
+
+_OCCURRENCES = ['must', 'filter', 'should', 'must_not']
+_CONJUNCTIONS = {'must', 'filter', 'must_not'}
+
+# query types wrapping other queries: {query type: {key: keeps scoring}}
+_WRAPPERS = {
+    'nested': {'query': True},
+    'has_child': {'query': True},
+    'has_parent': {'query': True},
+    'function_score': {'query': True},
+    'script_score': {'query': True},
+    'constant_score': {'filter': False},
+}
+
+# parts of a body which may read the scores of the hits
+_SCORING_KEYS = ['aggs', 'aggregations', 'rescore', 'collapse']
+
+
+def _as_list(value):
+    return value if isinstance(value, list) else [value]
+
+
+def _clause_type(clause):
+    if isinstance(clause, dict) and len(clause) == 1:
+        return next(iter(clause))
+    return None
+
+
+def _is_conjunction(clause):
+    """
+    A bool with at least one positive clause, which only and-s its clauses
+    """
+    if _clause_type(clause) != 'bool':
+        return False
+    inner = clause['bool']
+    return isinstance(inner, dict) and set(inner) <= _CONJUNCTIONS and \
+        ('must' in inner or 'filter' in inner)
+
+
+def _is_match_all(clause):
+    return _clause_type(clause) == 'bool' and clause['bool'] == {}
+
+
+def _optimize_wrapper(clause, query_type, scoring):
+    inner = clause[query_type]
+    if not isinstance(inner, dict):
+        return clause
+    optimized = dict(inner)
+    for key, keeps_scoring in _WRAPPERS[query_type].items():
+        if isinstance(inner.get(key), dict):
+            optimized[key] = optimize_query(inner[key],
+                                            scoring and keeps_scoring)
+    return {query_type: optimized}
+
+
+def _optimize_occurrences(inner, scoring):
+    occurrences = {}
+    for name in _OCCURRENCES:
+        if name not in inner:
+            continue
+        child_scoring = scoring and name in ('must', 'should')
+        occurrences[name] = [optimize_query(child, child_scoring)
+                             for child in _as_list(inner[name])]
+
+    if not scoring and 'must' in occurrences:
+        occurrences['filter'] = occurrences.pop('must') + \
+            occurrences.get('filter', [])
+
+    flattened = {name: [] for name in _OCCURRENCES}
+    match_all = []
+    for name in _OCCURRENCES:
+        for child in occurrences.get(name, []):
+            if name in ('must', 'filter') and _is_conjunction(child):
+                child_inner = child['bool']
+                for child_name in ['must', 'filter', 'must_not']:
+                    target = child_name
+                    if name == 'filter' and child_name == 'must':
+                        target = 'filter'
+                    flattened[target].extend(
+                        _as_list(child_inner.get(child_name, [])))
+            elif name == 'filter' and _is_match_all(child):
+                match_all.append(child)
+            else:
+                flattened[name].append(child)
+
+    # a bool needs a positive clause to keep matching every document
+    if match_all and not flattened['must'] and not flattened['filter']:
+        flattened['filter'].append(match_all[0])
+    return {name: clauses for name, clauses in flattened.items() if clauses}
+
+
+def _optimize_bool(clause, scoring):
+    inner = clause['bool']
+    if not isinstance(inner, dict):
+        return clause
+    occurrences = _optimize_occurrences(inner, scoring)
+
+    others = {key: value for key, value in inner.items()
+              if key not in _OCCURRENCES}
+    if not others and len(occurrences) == 1:
+        (name, clauses), = occurrences.items()
+        if len(clauses) == 1 and (name == 'must' or
+                                  (name == 'filter' and not scoring)):
+            return clauses[0]
+
+    optimized = {}
+    for name in _OCCURRENCES:
+        if name in occurrences:
+            clauses = occurrences[name]
+            single = len(clauses) == 1 and name in ('must', 'filter')
+            optimized[name] = clauses[0] if single else clauses
+    optimized.update(others)
+    return {'bool': optimized}
+
+
+def optimize_query(clause, scoring=True):
+    """
+    Optimized copy of a query clause. `scoring` is False where the score of
+    the clause is not used, e.g. in a filter.
+    """
+    query_type = _clause_type(clause)
+    if query_type == 'bool':
+        return _optimize_bool(clause, scoring)
+    if query_type in _WRAPPERS:
+        return _optimize_wrapper(clause, query_type, scoring)
+    return clause
+
+
+def _sort_key(sort):
+    if isinstance(sort, dict) and len(sort) == 1:
+        return next(iter(sort))
+    return sort
+
+
+def body_uses_scores(body):
+    """
+    Scores are not used when the hits are sorted on fields only, or when no
+    hits are returned at all, unless aggregations (e.g. `top_hits`),
+    rescoring or collapsing may read them
+    """
+    if body.get('track_scores') or 'min_score' in body:
+        return True
+    if any(key in body for key in _SCORING_KEYS):
+        return True
+    if body.get('size') == 0:
+        return False
+    sorts = body.get('sort')
+    if sorts is None:
+        return True
+    return any(_sort_key(sort) == '_score' for sort in _as_list(sorts))
+
+
+def optimize_body(body):
+    if 'query' not in body:
+        return body
+    optimized = dict(body)
+    optimized['query'] = optimize_query(body['query'], body_uses_scores(body))
+    return optimized
@@ -0,0 +1,118 @@
+"""
+Deep pagination with `search_after` cursors instead of `from`
+
+The body is sorted on the builder's sorts plus a unique tiebreaker, and each
+page asks for the hits after the sort values of the last hit of the previous
+one, so every page costs the same however deep it is and `max_result_window`
+does not apply:
+
+    for hit in builder.iter_hits(lambda body: client.search(body=body),
+                                 pit=pit_id):
+        ...
+
+`search` is any callable sending a body and returning the response. The next
+page is fetched in a background thread while the current one is consumed, so
+at most two pages are held at any time. With a point in time (`pit`), its id
+is sent with every page and updated from the responses, and `_shard_doc` is
+the tiebreaker by default. Without one, a `tiebreaker` field with a unique
+value per document must be given: sorting on `_id` is disabled by default
+since Elasticsearch 8.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_PAGE_SIZE = 1000
+
+
+def _page_builder(builder, tiebreaker):
+    paged = builder.clone().from_(0)
+    if tiebreaker not in paged.sorts:
+        paged = paged.sort(tiebreaker)
+    if not paged.misc.get('size'):
+        paged = paged.size(DEFAULT_PAGE_SIZE)
+    return paged
+
+
+def iter_pages(builder, search, tiebreaker=None, pit=None, keep_alive='1m',
+               prefetch=True):
+    """
+    Iterator over the hit lists of every page of `builder`'s search, in sort
+    order
+    """
+    if tiebreaker is None:
+        if pit is None:
+            raise ValueError("A tiebreaker field is needed without a point "
+                             "in time (pit)")
+        tiebreaker = '_shard_doc'
+    return _iter_pages(builder, search, tiebreaker, pit, keep_alive, prefetch)
+
+
+def _iter_pages(builder, search, tiebreaker, pit, keep_alive, prefetch):
+    paged = _page_builder(builder, tiebreaker)
+    size = paged.misc['size']
+    base = paged.build()
+    state = {'pit': pit}
+
+    def fetch(cursor):
+        body = dict(base)
+        if cursor is not None:
+            body['search_after'] = cursor
+        if state['pit'] is not None:
+            body['pit'] = {'id': state['pit'], 'keep_alive': keep_alive}
+        response = search(body)
+        # the point in time id can change from one response to the next
+        state['pit'] = response.get('pit_id', state['pit'])
+        return response['hits']['hits']
+
+    def cursor_of(hits):
+        if len(hits) < size:
+            return None
+        try:
+            return hits[-1]['sort']
+        except KeyError:
+            raise ValueError("Hits without sort values, the search endpoint "
+                             "should return the sorted hits") from None
+
+    if not prefetch:
+        hits = fetch(None)
+        while hits:
+            yield hits
+            cursor = cursor_of(hits)
+            if cursor is None:
+                return
+            hits = fetch(cursor)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    pending = None
+    try:
+        hits = fetch(None)
+        while hits:
+            cursor = cursor_of(hits)
+            pending = None if cursor is None else \
+                executor.submit(fetch, cursor)
+            yield hits
+            if pending is None:
+                return
+            hits = pending.result()
+    finally:
+        if pending is not None:
+            pending.cancel()
+        executor.shutdown(wait=True)
+
+
+def iter_hits(builder, search, tiebreaker=None, pit=None, keep_alive='1m',
+              prefetch=True):
+    """
+    Iterator over every hit of `builder`'s search, in sort order, see
+    `iter_pages`
+    """
+    return _iter_hits(iter_pages(builder, search, tiebreaker, pit,
+                                 keep_alive, prefetch))
+
+
+def _iter_hits(pages):
+    try:
+        for hits in pages:
+            yield from hits
+    finally:
+        pages.close()
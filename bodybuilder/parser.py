@@ -0,0 +1,165 @@
+"""
+Reverse parsing of an Elasticsearch body into the clauses of a builder
+
+Every part of the body is mapped to the clauses which `build()` turns back
+into exactly that part. Parts the builder would emit in a different shape
+are kept as they are: a query is then registered as a single clause, and
+sorts, aggregations or falsy `from`/`size` become raw options. A bool with
+`should` but no `must`/`filter` clauses is also kept as a single clause, since
+splitting it would make its `should` clauses optional once filters are added.
+Every node of the body is visited once.
+"""
+from .clauses import AggregationClause, QueryClause
+
+_OCCURRENCES = [('must', 'queries'), ('filter', 'filters'),
+                ('should', 'orFilters'), ('must_not', 'notFilters')]
+
+
+def parse_query_clause(node):
+    """
+    `QueryClause` emitting `node`, None if there is none
+    """
+    if not isinstance(node, dict) or len(node) != 1:
+        return None
+    (query_type, inner), = node.items()
+    if not isinstance(inner, dict):
+        return None
+    if not inner:
+        return QueryClause(query_type)
+    items = iter(inner.items())
+    field, value = next(items)
+    options = dict(items) or None
+    return QueryClause(query_type, field, value, options)
+
+
+def _bool_sections(query):
+    """
+    `[(list name, clauses)]` of a bool query in the shape emitted by the
+    builder, None for any other query
+    """
+    if not isinstance(query, dict) or list(query) != ['bool']:
+        return None
+    inner = query['bool']
+    if not isinstance(inner, dict) or not inner or \
+            not set(inner) <= {name for name, _ in _OCCURRENCES}:
+        return None
+    sections = []
+    for name, list_name in _OCCURRENCES:
+        if name not in inner:
+            continue
+        value = inner[name]
+        if name in ('must', 'filter'):
+            # one clause is emitted as a dict, more as a list
+            if isinstance(value, dict):
+                value = [value]
+            elif not isinstance(value, list) or len(value) < 2:
+                return None
+        elif not isinstance(value, list) or not value:
+            return None
+        clauses = [parse_query_clause(clause) for clause in value]
+        if None in clauses:
+            return None
+        sections.append((list_name, clauses))
+    # should clauses are required only while there is no must or filter
+    # clause, so should-only bools stay whole to keep that meaning when
+    # clauses are added to the builder
+    if not {'must', 'filter'} & set(inner):
+        return None
+    # a single must clause alone is emitted without the bool
+    if len(sections) == 1 and sections[0][0] == 'queries' and \
+            len(sections[0][1]) == 1:
+        return None
+    return sections
+
+
+def parse_query(builder, query):
+    sections = _bool_sections(query)
+    if sections is None:
+        clause = parse_query_clause(query)
+        if clause is None:
+            return False
+        sections = [('queries', [clause])]
+    for list_name, clauses in sections:
+        for clause in clauses:
+            builder._append_clause(list_name, clause)
+    return True
+
+
+def _parse_aggregation(name, node, builder_class):
+    if not isinstance(node, dict):
+        return None
+    types = [key for key in node if key != 'aggs']
+    if len(types) != 1 or not isinstance(node[types[0]], dict):
+        return None
+    query_type = types[0]
+    options = dict(node[query_type])
+    field = None
+    if options and isinstance(options.get('field'), str) and \
+            list(options)[-1] == 'field':
+        field = options.pop('field')
+    nested = None
+    if 'aggs' in node:
+        nested = builder_class()
+        if not parse_aggs(nested, node['aggs']):
+            return None
+    return AggregationClause(query_type, name, field, options or None,
+                             nested)
+
+
+def parse_aggs(builder, aggs):
+    if not isinstance(aggs, dict) or not aggs:
+        return False
+    clauses = []
+    for name, node in aggs.items():
+        clause = _parse_aggregation(name, node, builder.__class__)
+        if clause is None:
+            return False
+        clauses.append(clause)
+    for clause in clauses:
+        builder._append_clause('aggs', clause)
+    return True
+
+
+def parse_sorts(builder, sorts):
+    if not isinstance(sorts, list) or not sorts:
+        return False
+    keys = []
+    for sort in sorts:
+        if not isinstance(sort, dict) or len(sort) != 1:
+            return False
+        (key, order), = sort.items()
+        if not isinstance(order, dict) or list(order) != ['order']:
+            return False
+        keys.append((key, order['order']))
+    if len({key for key, _ in keys}) != len(keys):
+        return False
+    for key, order in keys:
+        builder.sort(key, order)
+    return True
+
+
+def parse_body(builder, body):
+    """
+    Register the parts of `body` on `builder`
+    """
+    for key, value in body.items():
+        if key == 'query':
+            parsed = parse_query(builder, value)
+        elif key == 'aggs':
+            parsed = parse_aggs(builder, value)
+        elif key == 'sort':
+            parsed = parse_sorts(builder, value)
+        elif key == 'from':
+            parsed = bool(value)
+            if parsed:
+                builder.from_(value)
+        elif key == 'size':
+            parsed = bool(value)
+            if parsed:
+                builder.size(value)
+        else:
+            parsed = False
+        if not parsed:
+            builder.rawOption(key, value)
+    return builder
+
@@ -0,0 +1,58 @@
+"""
+Persistent storage for the clauses of a builder
+
+Cloned builders share their clause lists; appending to one of them allocates
+only the new node and never shows up in the others.
+"""
+
+
+class PersistentList:
+
+    """
+    Append-only list sharing its prefix with the list it was appended to
+    """
+
+    __slots__ = ('_head', '_length', '_items')
+
+    def __init__(self, head=None, length=0):
+        self._head = head
+        self._length = length
+        self._items = None
+
+    @classmethod
+    def from_items(cls, items):
+        persistent = cls()
+        for item in items:
+            persistent = persistent.appended(item)
+        return persistent
+
+    def appended(self, item):
+        return PersistentList((item, self._head), self._length + 1)
+
+    def _materialize(self):
+        if self._items is None:
+            items = []
+            node = self._head
+            while node is not None:
+                items.append(node[0])
+                node = node[1]
+            items.reverse()
+            self._items = items
+        return self._items
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return iter(self._materialize())
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+    def __reduce__(self):
+        # pickle and deepcopy the flat items, not the linked nodes, which
+        # would recurse once per item
+        return (self.from_items, (list(self._materialize()),))
+
+    def __repr__(self):
+        return f"PersistentList({self._materialize()!r})"
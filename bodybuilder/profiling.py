@@ -0,0 +1,273 @@
+"""
+Opt-in instrumentation of `BodyBuilder.build()`
+
+While a hook is registered, every build which is not served from the cache
+records a `BuildProfile`: wall time and, if asked for, net allocated bytes of
+each build stage, the clause counts and the nesting depth of the builder.
+Nested builders built on the way are recorded as `children` of the profile,
+and their time is also reported as the `nested` stage of their parent.
+
+When no hook is registered a build only pays for one truthiness check.
+
+    with profile_builds() as profiles:
+        builder.build()
+    log_profiles(profiles)
+    text = to_openmetrics(profiles)
+    dump_stats(profiles, 'build.prof')  # readable with pstats.Stats
+"""
+import contextlib
+import logging
+import marshal
+import threading
+import time
+import tracemalloc
+
+from .clauses import ClauseGroup
+
+logger = logging.getLogger(__name__)
+
+# registered (callback, allocations) pairs, checked by every build and only
+# ever changed in place, as builder.py holds a reference to the list
+hooks = []
+
+_state = threading.local()
+
+_CLAUSE_LISTS = ['queries', 'filters', 'orFilters', 'notFilters', 'aggs']
+
+
+def _nested_builders(builder):
+    for name in _CLAUSE_LISTS:
+        for clause in getattr(builder, name):
+            if clause.nested is not None:
+                yield clause.nested_builder(builder.__class__)
+
+
+def _clause_total(clauses):
+    return sum(len(clause) if isinstance(clause, ClauseGroup) else 1
+               for clause in clauses)
+
+
+def nesting_depth(builder):
+    """
+    Number of builder levels, 1 for a builder without nested builders
+    """
+    return 1 + max((nesting_depth(nested)
+                    for nested in _nested_builders(builder)), default=0)
+
+
+class BuildProfile:
+
+    """
+    Measurements of a single build of `builder`
+    """
+
+    def __init__(self, builder):
+        self.builder_class = builder.__class__.__name__
+        self.stages = {}
+        self.allocations = {}
+        self.clauses = {name: _clause_total(getattr(builder, name))
+                        for name in _CLAUSE_LISTS}
+        self.clauses['sorts'] = len(builder.sorts)
+        self.depth = nesting_depth(builder)
+        self.children = []
+        # seconds spent building nested builders, by the stage doing it
+        self.nested_stages = {}
+        self.total = 0.0
+        self._stage = None
+
+    @property
+    def nested(self):
+        return sum(self.nested_stages.values())
+
+    def as_dict(self):
+        return {
+            'builder': self.builder_class,
+            'total': self.total,
+            'stages': dict(self.stages, nested=self.nested),
+            'allocations': dict(self.allocations),
+            'clauses': dict(self.clauses),
+            'depth': self.depth,
+            'children': [child.as_dict() for child in self.children],
+        }
+
+    def __repr__(self):
+        return f"BuildProfile(total={self.total:.6f}, depth={self.depth})"
+
+
+def add_build_hook(callback, allocations=False):
+    """
+    Call `callback(profile)` after every top-level build. With
+    `allocations`, tracemalloc is started if needed to measure the net
+    bytes allocated by each stage, which slows builds down noticeably.
+    """
+    hooks.append((callback, allocations))
+
+
+def remove_build_hook(callback):
+    hooks[:] = [hook for hook in hooks if hook[0] != callback]
+
+
+@contextlib.contextmanager
+def profile_builds(allocations=False):
+    """
+    Collect the profiles of the builds run inside the block into a list
+    """
+    profiles = []
+    add_build_hook(profiles.append, allocations)
+    try:
+        yield profiles
+    finally:
+        remove_build_hook(profiles.append)
+
+
+def run_profiled(builder, steps):
+    """
+    Run the `(stage, step)` pairs of a build of `builder` and record them
+    """
+    track_allocations = any(allocations for _, allocations in hooks)
+    started_tracing = track_allocations and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    stack = getattr(_state, 'stack', None)
+    if stack is None:
+        stack = _state.stack = []
+    profile = BuildProfile(builder)
+    stack.append(profile)
+    try:
+        build_start = time.perf_counter()
+        for stage, step in steps:
+            profile._stage = stage
+            if track_allocations:
+                memory_start = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+            step()
+            profile.stages[stage] = time.perf_counter() - start
+            if track_allocations:
+                profile.allocations[stage] = \
+                    tracemalloc.get_traced_memory()[0] - memory_start
+        profile.total = time.perf_counter() - build_start
+    finally:
+        stack.pop()
+        if started_tracing:
+            tracemalloc.stop()
+
+    if stack:
+        parent = stack[-1]
+        parent.children.append(profile)
+        parent.nested_stages[parent._stage] = \
+            parent.nested_stages.get(parent._stage, 0.0) + profile.total
+        return
+    for callback, _ in list(hooks):
+        callback(profile)
+
+
+def log_profiles(profiles, log=None, level=logging.DEBUG):
+    """
+    Log one line per build, with the stage timings in milliseconds
+    """
+    log = log or logger
+    for profile in profiles:
+        stages = ' '.join(
+            f"{stage}={seconds * 1000:.3f}ms"
+            for stage, seconds in dict(profile.stages,
+                                       nested=profile.nested).items())
+        clauses = ' '.join(f"{name}={count}"
+                           for name, count in profile.clauses.items())
+        log.log(level, "build %.3fms depth=%d %s %s", profile.total * 1000,
+                profile.depth, stages, clauses)
+
+
+def _metric(lines, name, metric_type, help_text, samples):
+    lines.append(f"# TYPE {name} {metric_type}")
+    lines.append(f"# HELP {name} {help_text}")
+    for labels, value in samples:
+        label_text = ','.join(f'{key}="{label}"' for key, label in labels)
+        suffix = '_total' if metric_type == 'counter' else ''
+        lines.append(f"{name}{suffix}{{{label_text}}} {value!r}"
+                     if label_text else f"{name}{suffix} {value!r}")
+
+
+def to_openmetrics(profiles):
+    """
+    OpenMetrics text exposition of the totals over `profiles`
+    """
+    stage_seconds = {}
+    stage_bytes = {}
+    clauses = {}
+    for profile in profiles:
+        for stage, seconds in dict(profile.stages,
+                                   nested=profile.nested).items():
+            stage_seconds[stage] = stage_seconds.get(stage, 0.0) + seconds
+        for stage, allocated in profile.allocations.items():
+            stage_bytes[stage] = stage_bytes.get(stage, 0) + allocated
+        for name, count in profile.clauses.items():
+            clauses[name] = clauses.get(name, 0) + count
+
+    lines = []
+    _metric(lines, 'bodybuilder_builds', 'counter',
+            "Builds which were not served from the cache.",
+            [((), len(profiles))])
+    _metric(lines, 'bodybuilder_build_seconds', 'counter',
+            "Wall time spent in builds.",
+            [((), sum(profile.total for profile in profiles))])
+    _metric(lines, 'bodybuilder_build_stage_seconds', 'counter',
+            "Wall time spent in each build stage, nested builds included.",
+            [((('stage', stage),), seconds)
+             for stage, seconds in stage_seconds.items()])
+    if stage_bytes:
+        _metric(lines, 'bodybuilder_build_stage_allocated_bytes', 'counter',
+                "Net bytes allocated by each build stage.",
+                [((('stage', stage),), allocated)
+                 for stage, allocated in stage_bytes.items()])
+    _metric(lines, 'bodybuilder_build_clauses', 'counter',
+            "Clauses emitted by builds.",
+            [((('kind', name),), count) for name, count in clauses.items()])
+    _metric(lines, 'bodybuilder_build_max_depth', 'gauge',
+            "Deepest builder nesting seen.",
+            [((), max((profile.depth for profile in profiles), default=0))])
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+_BUILD_FUNCTION = ('bodybuilder', 0, 'build')
+_NESTED_FUNCTION = ('bodybuilder', 0, 'nested')
+
+
+def to_pstats(profiles):
+    """
+    The stats dict of `cProfile.Profile`, with `build` calling one function
+    per stage and the stages calling `nested` for nested builders, so that
+    it can be loaded with `pstats.Stats`
+    """
+    stats = {}
+
+    def add(function, seconds, inline_seconds, caller=None):
+        calls, _, inline, cumulative, callers = stats.get(
+            function, (0, 0, 0.0, 0.0, {}))
+        if caller is not None:
+            caller_stats = callers.get(caller, (0, 0, 0.0, 0.0))
+            callers[caller] = (caller_stats[0] + 1, caller_stats[1] + 1,
+                               caller_stats[2] + inline_seconds,
+                               caller_stats[3] + seconds)
+        stats[function] = (calls + 1, calls + 1, inline + inline_seconds,
+                           cumulative + seconds, callers)
+
+    for profile in profiles:
+        add(_BUILD_FUNCTION, profile.total,
+            profile.total - sum(profile.stages.values()))
+        for stage, seconds in profile.stages.items():
+            nested = profile.nested_stages.get(stage, 0.0)
+            function = ('bodybuilder', 0, stage)
+            add(function, seconds, seconds - nested, _BUILD_FUNCTION)
+            if nested:
+                add(_NESTED_FUNCTION, nested, nested, function)
+    return stats
+
+
+def dump_stats(profiles, path):
+    """
+    Write `profiles` in the file format of `cProfile.Profile.dump_stats`
+    """
+    with open(path, 'wb') as fh:
+        marshal.dump(to_pstats(profiles), fh)
@@ -0,0 +1,270 @@
+"""
+Direct-to-JSON serialization of a builder, without the intermediate dict tree
+
+The output is byte-for-byte identical to `json.dumps(builder.build())`:
+the structure is walked from the builder's clause lists as a stream of JSON
+fragments, while runs of clauses without unbuilt nested builders are handed
+in small batches to the C accelerated JSON encoder. Nothing larger than one
+such batch is held in memory at once.
+"""
+import json
+
+from .clauses import iter_clauses, single_clause
+
+_ENCODER = json.JSONEncoder()
+_encode = _ENCODER.encode
+
+
+class _Section:
+
+    """
+    Placeholder for a value whose fragments are yielded lazily by `iterate()`
+    """
+
+    __slots__ = ('iterate',)
+
+    def __init__(self, iterate):
+        self.iterate = iterate
+
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return _encode(key)
+    if key is True:
+        return '"true"'
+    if key is False:
+        return '"false"'
+    if key is None:
+        return '"null"'
+    if isinstance(key, (int, float)):
+        return '"' + _encode(key) + '"'
+    raise TypeError(f"keys must be str, int, float, bool or None, "
+                    f"not {key.__class__.__name__}")
+
+
+# runs of plain values are encoded in batches of this many items with one
+# call to the C encoder, which is far cheaper than one call per item
+_BATCH_SIZE = 128
+
+
+def _iter_object(items):
+    """
+    `items` is a dict whose values may be `_Section` placeholders, so that
+    repeated keys keep the position and value that `build()` gives them
+    """
+    if not items:
+        yield '{}'
+        return
+    separator = '{'
+    batch = {}
+    for key, value in items.items():
+        if not isinstance(value, _Section):
+            batch[key] = value
+            if len(batch) < _BATCH_SIZE:
+                continue
+        if batch:
+            yield separator + _encode(batch)[1:-1]
+            separator = ', '
+            batch = {}
+        if isinstance(value, _Section):
+            yield separator + _encode_key(key) + ': '
+            separator = ', '
+            yield from value.iterate()
+    if batch:
+        yield separator + _encode(batch)[1:-1]
+    yield '}'
+
+
+def _iter_array(values, iter_item):
+    if not values:
+        yield '[]'
+        return
+    first = True
+    for value in values:
+        yield '[' if first else ', '
+        first = False
+        yield from iter_item(value)
+    yield ']'
+
+
+def _cached_body(builder):
+    """
+    The body already built and cached by `builder`, if any. Encoding it is
+    cheaper than walking the builder again and holds no extra memory.
+    """
+    if builder._dirty or builder._volatile:
+        return None
+    return builder.body
+
+
+def _nested_query_section(builder_class, clause):
+    built_class = clause.nested_builder(builder_class)
+    cached = _cached_body(built_class)
+    if len(built_class.filters) > 0:
+        if cached is not None:
+            return 'filter', cached['query']['bool']['filter']
+        return 'filter', _Section(lambda: _iter_clauses(
+            builder_class, built_class.filters, False))
+    if not built_class.query_exists():
+        raise KeyError('query')
+    if cached is not None:
+        return 'query', cached['query']
+    return 'query', _Section(lambda: _iter_query(built_class))
+
+
+def _nested_aggs_section(builder_class, clause):
+    built_class = clause.nested_builder(builder_class)
+    if len(built_class.aggs) == 0:
+        raise KeyError('aggs')
+    cached = _cached_body(built_class)
+    if cached is not None:
+        return cached['aggs']
+    return _Section(lambda: _iter_aggs(built_class))
+
+
+def _query_clause(builder_class, clause):
+    """
+    The clause as a plain dict, or as a `_Section` when it has a nested
+    builder which has not been built yet
+    """
+    inner = clause.inner()
+    if clause.nested is not None:
+        key, section = _nested_query_section(builder_class, clause)
+        inner[key] = section
+        if isinstance(section, _Section):
+            return _Section(lambda: _iter_object(
+                {clause.type: _Section(lambda: _iter_object(inner))}))
+    return {clause.type: inner}
+
+
+def _iter_value(value):
+    if isinstance(value, _Section):
+        return value.iterate()
+    return iter((_encode(value),))
+
+
+def _iter_clause_array(builder_class, clauses):
+    if len(clauses) == 0:
+        yield '[]'
+        return
+    separator = '['
+    batch = []
+    for clause in iter_clauses(clauses):
+        value = _query_clause(builder_class, clause)
+        if not isinstance(value, _Section):
+            batch.append(value)
+            if len(batch) < _BATCH_SIZE:
+                continue
+        if batch:
+            yield separator + _encode(batch)[1:-1]
+            separator = ', '
+            batch = []
+        if isinstance(value, _Section):
+            yield separator
+            separator = ', '
+            yield from value.iterate()
+    if batch:
+        yield separator + _encode(batch)[1:-1]
+    yield ']'
+
+
+def _iter_clauses(builder_class, clauses, always_array):
+    clause = None if always_array else single_clause(clauses)
+    if clause is not None:
+        return _iter_value(_query_clause(builder_class, clause))
+    return _iter_clause_array(builder_class, clauses)
+
+
+def _iter_query(builder):
+    builder_class = builder.__class__
+    if builder.is_simple_query():
+        yield from _iter_value(_query_clause(builder_class,
+                                             single_clause(builder.queries)))
+        return
+
+    sections = [
+        ('must', builder.queries, False),
+        ('filter', builder.filters, False),
+        ('should', builder.orFilters, True),
+        ('must_not', builder.notFilters, True),
+    ]
+    first = True
+    for name, clauses, always_array in sections:
+        if len(clauses) == 0:
+            continue
+        yield ('{"bool": {' if first else ', ') + _encode(name) + ': '
+        first = False
+        yield from _iter_clauses(builder_class, clauses, always_array)
+    yield '}}'
+
+
+def _aggregation_item(builder_class, clause):
+    inner = {clause.type: clause.all_options()}
+    if clause.nested is None:
+        return clause.name, inner
+    inner['aggs'] = _nested_aggs_section(builder_class, clause)
+    if not isinstance(inner['aggs'], _Section):
+        return clause.name, inner
+    return clause.name, _Section(lambda: _iter_object(inner))
+
+
+def _iter_aggs(builder):
+    builder_class = builder.__class__
+    aggs = {}
+    for clause in builder.aggs:
+        query_name, section = _aggregation_item(builder_class, clause)
+        aggs[query_name] = section
+    return _iter_object(aggs)
+
+
+def _iter_sorts(sorts):
+    def iter_sort(item):
+        key, value = item
+        yield '{' + _encode_key(key) + ': {"order": ' + _encode(value) + '}}'
+    return _iter_array(list(sorts.items()), iter_sort)
+
+
+def iter_body(builder):
+    """
+    Yield the fragments of the JSON encoding of `builder.build()`
+    """
+    if builder.deduplicate or builder.batch_terms:
+        # these passes rewrite the built clauses, so encode their result
+        yield _encode(builder._build_cached())
+        return
+    body = {}
+    if builder.query_exists():
+        body['query'] = _Section(lambda: _iter_query(builder))
+    if len(builder.sorts) > 0:
+        body['sort'] = _Section(lambda: _iter_sorts(builder.sorts))
+    for key, value in builder.rawOptions.items():
+        body[key] = value
+    if builder.misc.get('from'):
+        body['from'] = builder.misc.get('from')
+    if builder.misc.get('size'):
+        body['size'] = builder.misc.get('size')
+    if len(builder.aggs) > 0:
+        body['aggs'] = _Section(lambda: _iter_aggs(builder))
+    yield from _iter_object(body)
+
+
+def iter_chunks(builder, chunk_size):
+    """
+    Join the fragments of `iter_body` into chunks of at least `chunk_size`
+    characters, except for the last one
+    """
+    buffer = []
+    buffered = 0
+    for fragment in iter_body(builder):
+        buffer.append(fragment)
+        buffered += len(fragment)
+        if buffered >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def dumps(builder):
+    return ''.join(iter_body(builder))
@@ -0,0 +1,106 @@
+"""
+Builders described by declarative (JSON) specs instead of call chains
+
+A spec is a list of entries, each naming a chain method and its arguments.
+Nested clauses are given as `children`, a spec of their own, in place of the
+lambda, and `{"$param": name}` stands for a template placeholder:
+
+    [
+        {"op": "query", "args": ["match", "message", {"$param": "text"}]},
+        {"op": "orFilter", "args": ["bool"], "children": [
+            {"op": "filter", "args": ["term", "tag", "a"]}
+        ]},
+        {"op": "size", "args": [10]}
+    ]
+
+`compile_spec` turns a spec into a `Template` and caches it by the hash of
+the spec's content, so each spec is only parsed once per process.
+"""
+import collections
+import hashlib
+import json
+
+from .builder import BodyBuilder
+from .template import Param
+
+OPS = {
+    'query': BodyBuilder.query,
+    'filter': BodyBuilder.filter,
+    'orFilter': BodyBuilder.orFilter,
+    'notFilter': BodyBuilder.notFilter,
+    'aggregation': BodyBuilder.aggregation,
+    'sort': BodyBuilder.sort,
+    'from': BodyBuilder.from_,
+    'from_': BodyBuilder.from_,
+    'size': BodyBuilder.size,
+    'rawOption': BodyBuilder.rawOption,
+    'queryMinimumShouldMatch': BodyBuilder.queryMinimumShouldMatch,
+    'filterMinimumShouldMatch': BodyBuilder.filterMinimumShouldMatch,
+}
+_NESTING_OPS = {'query', 'filter', 'orFilter', 'notFilter', 'aggregation'}
+
+_CACHE_SIZE = 1024
+_cache = collections.OrderedDict()
+
+
+def _placeholders(node):
+    if isinstance(node, dict):
+        if len(node) == 1 and '$param' in node:
+            return Param(node['$param'])
+        return {key: _placeholders(value) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_placeholders(value) for value in node]
+    return node
+
+
+def build_spec(spec, builder=None):
+    """
+    Apply the entries of `spec` to `builder` (a new `BodyBuilder` by
+    default) and return it
+    """
+    if isinstance(spec, (str, bytes)):
+        spec = json.loads(spec)
+    builder = BodyBuilder() if builder is None else builder
+    if not isinstance(spec, list):
+        raise ValueError("A spec should be a list of entries")
+    for entry in spec:
+        if not isinstance(entry, dict) or 'op' not in entry:
+            raise ValueError(f"Spec entry without an op: {entry!r}")
+        op = entry['op']
+        if op not in OPS:
+            raise ValueError(f"Unknown spec op {op!r}")
+        args = [_placeholders(arg) for arg in entry.get('args', [])]
+        if 'children' in entry:
+            if op not in _NESTING_OPS:
+                raise ValueError(f"Spec op {op!r} cannot have children")
+            args.append(build_spec(entry['children']))
+        OPS[op](builder, *args)
+    return builder
+
+
+def spec_hash(spec):
+    """
+    Content hash of a spec; JSON text is hashed as is, without parsing it
+    """
+    if isinstance(spec, str):
+        spec = spec.encode('utf-8')
+    if not isinstance(spec, bytes):
+        spec = json.dumps(spec, sort_keys=True, separators=(',', ':'),
+                          ensure_ascii=False).encode('utf-8')
+    return hashlib.sha256(spec).hexdigest()
+
+
+def compile_spec(spec):
+    """
+    `Template` of the body described by `spec`, a list of entries or their
+    JSON text, compiled once and then served from a cache
+    """
+    key = spec_hash(spec)
+    try:
+        template = _cache[key]
+    except KeyError:
+        template = build_spec(spec).compile()
+        _cache[key] = template
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return template
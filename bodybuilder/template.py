@@ -0,0 +1,121 @@
+"""
+Compiled query templates with named placeholders
+"""
+
+
+class Param:
+
+    """
+    Named placeholder which is filled in when a template is rendered
+    """
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Param({self.name!r})"
+
+
+class _OptionalParam(Param):
+
+    """
+    Placeholder of a top level option which `build()` leaves out when its
+    value is falsy (`from`, `size`); rendering leaves it out the same way
+    """
+
+    __slots__ = ()
+
+
+def _collect_params(node, names):
+    if isinstance(node, Param):
+        names.add(node.name)
+    elif isinstance(node, dict):
+        for key, value in node.items():
+            _collect_params(key, names)
+            _collect_params(value, names)
+    elif isinstance(node, (list, tuple)):
+        for value in node:
+            _collect_params(value, names)
+    return names
+
+
+def _source(node, constants):
+    """
+    Python expression which rebuilds `node`, reading placeholders from `p`
+    and every other leaf from the constants table `c`
+    """
+    if isinstance(node, Param):
+        return f"p[{node.name!r}]"
+    if isinstance(node, dict):
+        items = ', '.join(f"{_source(key, constants)}: {_source(value, constants)}"  # noqa E501
+                          for key, value in node.items())
+        return '{' + items + '}'
+    if isinstance(node, list):
+        return '[' + ', '.join(_source(value, constants) for value in node) + ']'  # noqa E501
+    if isinstance(node, tuple):
+        return '(' + ''.join(_source(value, constants) + ', ' for value in node) + ')'  # noqa E501
+    constants.append(node)
+    return f"c[{len(constants) - 1}]"
+
+
+def _compile_source(body):
+    constants = []
+    code = compile(f"lambda p: {_source(body, constants)}",
+                   '<bodybuilder template>', 'eval')
+    return eval(code, {'c': constants})
+
+
+def _compile_closure(node):
+    """
+    Slower fallback for bodies nested too deeply for the Python parser
+    """
+    if isinstance(node, Param):
+        return lambda p: p[node.name]
+    if isinstance(node, dict):
+        items = [(_compile_closure(key), _compile_closure(value))
+                 for key, value in node.items()]
+        return lambda p: {key(p): value(p) for key, value in items}
+    if isinstance(node, (list, tuple)):
+        items = [_compile_closure(value) for value in node]
+        if isinstance(node, tuple):
+            return lambda p: tuple(value(p) for value in items)
+        return lambda p: [value(p) for value in items]
+    return lambda p: node
+
+
+class Template:
+
+    """
+    A body compiled once from a builder chain. Rendering only fills in the
+    placeholder slots and never re-parses the builder arguments.
+    """
+
+    def __init__(self, body):
+        self.source = body
+        self.params = frozenset(_collect_params(body, set()))
+        self._optional = [key for key, value in body.items()
+                          if isinstance(value, _OptionalParam)] \
+            if isinstance(body, dict) else []
+        try:
+            self._render = _compile_source(body)
+        except (SyntaxError, RecursionError, MemoryError):
+            self._render = _compile_closure(body)
+
+    def __reduce__(self):
+        # the compiled render function cannot be pickled, compile it again
+        return (self.__class__, (self.source,))
+
+    def render(self, **params):
+        try:
+            body = self._render(params)
+        except KeyError as e:
+            if e.args and e.args[0] in self.params:
+                raise KeyError(
+                    f"Missing value for template parameter '{e.args[0]}'")
+            raise
+        for key in self._optional:
+            if not body[key]:
+                del body[key]
+        return body
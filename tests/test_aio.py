@@ -0,0 +1,259 @@
+"""
+Tests for the asyncio execution layer, against a local stand-in of the
+search endpoint
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+from bodybuilder.aio import AsyncSearchClient, SearchError
+
+
+class StandInServer:
+
+    """
+    Minimal keep-alive HTTP server answering `_search` with the request it
+    got and `_msearch` with one such response per search
+    """
+
+    def __init__(self, delay=0.0, chunked=False, close_after=None,
+                 until_eof=False):
+        self.delay = delay
+        self.chunked = chunked
+        self.close_after = close_after
+        self.until_eof = until_eof
+        self.authorization = []
+        self.connections = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        port = self.server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def respond(self, path, body):
+        if path.endswith('/_msearch'):
+            lines = body.decode('utf-8').splitlines()
+            return 200, {'responses': [
+                {'header': json.loads(header), 'body': json.loads(search)}
+                for header, search in zip(lines[::2], lines[1::2])]}
+        if 'error' in path:
+            return 400, {'error': 'bad request'}
+        return 200, {'path': path, 'body': json.loads(body),
+                     'connection': self.connections}
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        handled = 0
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    return
+                _, path, _ = request_line.decode('latin-1').split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line == b'\r\n':
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(
+                    int(headers['content-length']))
+
+                self.requests += 1
+                self.authorization.append(headers.get('authorization'))
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                await asyncio.sleep(self.delay)
+                self.in_flight -= 1
+
+                status, response = self.respond(path, body)
+                payload = json.dumps(response).encode('utf-8')
+                head = f"HTTP/1.1 {status} OK\r\n" \
+                    "Content-Type: application/json\r\n"
+                if self.until_eof:
+                    # the end of the body is marked by closing the connection
+                    writer.write(head.encode('latin-1') + b'\r\n' + payload)
+                    await writer.drain()
+                    return
+                if self.chunked:
+                    head += "Transfer-Encoding: chunked\r\n\r\n"
+                    middle = len(payload) // 2
+                    payload = b''.join(
+                        b'%x\r\n%s\r\n' % (len(part), part)
+                        for part in (payload[:middle], payload[middle:])
+                    ) + b'0\r\n\r\n'
+                else:
+                    head += f"Content-Length: {len(payload)}\r\n\r\n"
+                writer.write(head.encode('latin-1') + payload)
+                await writer.drain()
+                handled += 1
+                if handled == self.close_after:
+                    return
+        finally:
+            writer.close()
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def builder(i=0):
+    return bodyBuilder().query('match', 'message', 'test') \
+        .filter('term', 'user', f'user_{i}')
+
+
+class TestAsyncSearchClient:
+
+    @pytest.mark.parametrize('chunked', [False, True])
+    def test__search(self, chunked):
+        async def main():
+            async with StandInServer(chunked=chunked) as server:
+                async with AsyncSearchClient(server.url) as client:
+                    first = await client.search(builder(), index='tweets')
+                    second = await client.search({'size': 0},
+                                                 params={'timeout': '1s'})
+                return first, second, server.connections
+
+        first, second, connections = run(main())
+        assert first['path'] == '/tweets/_search'
+        assert first['body'] == builder().build()
+        assert second['path'] == '/_search?timeout=1s'
+        assert second['body'] == {'size': 0}
+        assert connections == 1
+
+    def test__msearch(self):
+        async def main():
+            async with StandInServer() as server:
+                async with AsyncSearchClient(server.url) as client:
+                    return await client.msearch(
+                        [builder(1), ({'index': 'other'}, builder(2))],
+                        index='tweets', header={'index': 'tweets'})
+
+        responses = run(main())
+        assert responses == [
+            {'header': {'index': 'tweets'}, 'body': builder(1).build()},
+            {'header': {'index': 'other'}, 'body': builder(2).build()},
+        ]
+
+    def test__concurrency_limit_and_order(self):
+        async def main():
+            async with StandInServer(delay=0.01) as server:
+                async with AsyncSearchClient(server.url,
+                                             max_connections=3) as client:
+                    responses = [response async for response in
+                                 client.iter_search(builder(i)
+                                                    for i in range(20))]
+                    gathered = await asyncio.gather(
+                        *(client.search(builder(i)) for i in range(10)))
+                return responses + gathered, server
+
+        responses, server = run(main())
+        assert [response['body'] for response in responses] == \
+            [builder(i).build() for i in range(20)] + \
+            [builder(i).build() for i in range(10)]
+        assert server.max_in_flight <= 3
+        assert server.connections <= 3
+        assert server.requests == 30
+
+    def test__backpressure(self):
+        pulled = []
+
+        def bodies():
+            for i in range(100):
+                pulled.append(i)
+                yield builder(i)
+
+        async def main():
+            async with StandInServer() as server:
+                async with AsyncSearchClient(server.url,
+                                             max_connections=4) as client:
+                    responses = client.iter_search(bodies())
+                    await responses.__anext__()
+                    await responses.aclose()
+
+        run(main())
+        assert len(pulled) <= 5
+
+    def test__timeout(self):
+        async def main():
+            async with StandInServer(delay=0.5) as server:
+                async with AsyncSearchClient(server.url,
+                                             timeout=0.05) as client:
+                    with pytest.raises(asyncio.TimeoutError):
+                        await client.search(builder())
+                    server.delay = 0
+                    return await client.search(builder())
+
+        assert run(main())['body'] == builder().build()
+
+    def test__error_status(self):
+        async def main():
+            async with StandInServer() as server:
+                async with AsyncSearchClient(server.url) as client:
+                    with pytest.raises(SearchError) as error:
+                        await client.search(builder(), index='error')
+                    assert error.value.status == 400
+                    return await client.search(builder())
+
+        assert run(main())['body'] == builder().build()
+
+    def test__reconnect_after_server_closes(self):
+        async def main():
+            async with StandInServer(close_after=1) as server:
+                async with AsyncSearchClient(server.url) as client:
+                    responses = [await client.search(builder(i))
+                                 for i in range(3)]
+                return responses, server.connections
+
+        responses, connections = run(main())
+        assert [response['body'] for response in responses] == \
+            [builder(i).build() for i in range(3)]
+        assert connections == 3
+
+    def test__credentials_from_url(self):
+        async def main():
+            async with StandInServer() as server:
+                url = server.url.replace('http://', 'http://elastic:p%40ss@')
+                async with AsyncSearchClient(url) as client:
+                    await client.search(builder())
+                async with AsyncSearchClient(server.url) as client:
+                    await client.search(builder())
+                return server.authorization
+
+        assert run(main()) == ['Basic ZWxhc3RpYzpwQHNz', None]
+
+    def test__body_read_until_eof(self):
+        async def main():
+            async with StandInServer(until_eof=True) as server:
+                async with AsyncSearchClient(server.url) as client:
+                    responses = [await client.search(builder(i))
+                                 for i in range(2)]
+                    return responses, len(client._idle), server.connections
+
+        responses, idle, connections = run(main())
+        assert [response['body'] for response in responses] == \
+            [builder(i).build() for i in range(2)]
+        assert idle == 0
+        assert connections == 2
+
+    def test__none_bodies_do_not_end_iteration(self):
+        async def main():
+            async with StandInServer() as server:
+                async with AsyncSearchClient(server.url) as client:
+                    return [response async for response in
+                            client.iter_search([builder(0), None, {}])]
+
+        assert [response['body'] for response in run(main())] == \
+            [builder(0).build(), None, {}]
@@ -0,0 +1,92 @@
+"""
+Tests for building bodies in a process pool
+"""
+
+import json
+import pickle
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder, Param
+from bodybuilder.batch import build_batch, iter_build
+
+
+def tweets_by_user(user, size):
+    return bodyBuilder() \
+        .filter('term', 'user', user) \
+        .orFilter('bool', bodyBuilder().filter('term', 'tag', 'a')) \
+        .size(size)
+
+
+def expected(user, size):
+    return tweets_by_user(user, size).build()
+
+
+PARAM_SETS = [{'user': f'user_{i}', 'size': i % 7 + 1} for i in range(50)]
+
+
+class TestBatch:
+
+    def test__template_spec(self):
+        spec = bodyBuilder() \
+            .filter('term', 'user', Param('user')) \
+            .orFilter('bool', bodyBuilder().filter('term', 'tag', 'a')) \
+            .size(Param('size')) \
+            .compile()
+        results = build_batch(spec, PARAM_SETS, max_workers=2, chunksize=8)
+
+        assert results == [expected(**params) for params in PARAM_SETS]
+
+    def test__builder_spec_as_json(self):
+        spec = bodyBuilder() \
+            .filter('term', 'user', Param('user')) \
+            .orFilter('bool', lambda b: b.filter('term', 'tag', 'a')) \
+            .size(Param('size'))
+        results = build_batch(spec, iter(PARAM_SETS), max_workers=2,
+                              chunksize=8, as_json=True)
+
+        assert results == [json.dumps(expected(**params))
+                           for params in PARAM_SETS]
+
+    def test__function_spec_unordered(self):
+        results = iter_build(tweets_by_user, PARAM_SETS, max_workers=2,
+                             chunksize=3, ordered=False)
+
+        assert sorted(results, key=lambda item: item[0]) == \
+            [(i, expected(**params)) for i, params in enumerate(PARAM_SETS)]
+
+    def test__worker_errors_are_raised(self):
+        spec = bodyBuilder().filter('term', 'user', Param('user')).compile()
+        with pytest.raises(KeyError):
+            build_batch(spec, [{'user': 'a'}, {}], max_workers=1)
+
+    def test__early_close(self):
+        results = iter_build(tweets_by_user, PARAM_SETS * 20, max_workers=2,
+                             chunksize=4)
+        assert next(results) == expected(**PARAM_SETS[0])
+        results.close()
+
+    def test__builder_and_template_pickle(self):
+        builder = bodyBuilder() \
+            .query('nested', 'path', 'obj1', lambda q: q
+                   .query('match', 'obj1.name', Param('name'))) \
+            .aggregation('terms', 'user', bodyBuilder()
+                         .aggregation('max', 'grade'))
+        template = pickle.loads(pickle.dumps(builder.compile()))
+
+        assert pickle.loads(pickle.dumps(builder)).compile() \
+            .render(name='blue') == template.render(name='blue')
+        assert template.render(name='blue') == {
+            'query': {'nested': {'path': 'obj1', 'query': {
+                'match': {'obj1.name': 'blue'}}}},
+            'aggs': {'agg_terms_user': {
+                'terms': {'field': 'user'},
+                'aggs': {'agg_max_grade': {'max': {'field': 'grade'}}}}}}
+
+    def test__nested_builder_argument_is_copied(self):
+        nested = bodyBuilder().filter('term', 'tag', 'a')
+        builder = bodyBuilder().filter('bool', nested)
+        nested.filter('term', 'tag', 'b')
+
+        assert builder.build() == bodyBuilder().filter(
+            'bool', lambda b: b.filter('term', 'tag', 'a')).build()
@@ -0,0 +1,131 @@
+"""
+Tests for the size and complexity budgets of a builder
+"""
+
+import warnings
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+from bodybuilder import Budget, BudgetExceededError, BudgetWarning, Volatile
+
+
+class TestBudget:
+
+    def test__counts(self):
+        builder = bodyBuilder() \
+            .query('match', 'message', 'this is a test') \
+            .filter('bool', lambda b: b
+                    .filter('term', 'user', 'kimchy')
+                    .notFilter('nested', 'path', 'obj1',
+                               lambda q: q.query('term', 'obj1.name', 'a'))) \
+            .aggregation('terms', 'user', lambda a: a
+                         .aggregation('max', 'grade')
+                         .aggregation('min', 'grade'))
+
+        assert builder.clause_count == 5
+        assert builder.depth == 3
+        assert builder.aggregation_count == 3
+
+    @pytest.mark.parametrize('builder', [
+        bodyBuilder().query('match', 'message', 'this is a test'),
+        bodyBuilder().filter('term', 'user', 'kimchy')
+        .orFilter('range', 'count', {'gte': 1, 'lt': 10})
+        .notFilter('terms', 'tags', ['a', 'b', 'c'])
+        .sort('timestamp', 'desc').sort('_score').size(10)
+        .rawOption('_source', ['user', 'message']),
+        bodyBuilder().aggregation('terms', 'user', {'size': 10}, lambda a: a
+                                  .aggregation('percentiles', 'load_time',
+                                               {'percents': [1, 5, 50]})),
+        bodyBuilder().query('nested', 'path', 'obj1', {'score_mode': 'avg'},
+                            lambda q: q
+                            .query('match', 'obj1.name', 'blue')
+                            .query('range', 'obj1.count', {'gt': 5})),
+    ])
+    def test__estimated_size(self, builder):
+        actual = len(builder.build_json())
+        assert actual * 0.7 <= builder.estimated_size <= actual * 1.5
+
+    def test__overwritten_options_are_not_counted_twice(self):
+        builder = bodyBuilder().rawOption('_source', ['a' * 1000])
+        builder.rawOption('_source', ['b'])
+        builder.sort('timestamp').sort('timestamp', 'desc')
+
+        assert builder.estimated_size < 100
+
+    def test__raise_on_clauses(self):
+        builder = bodyBuilder(budget=Budget(max_clauses=3))
+        builder.filter('term', 'a', 1).filter('term', 'b', 2) \
+            .filter('term', 'c', 3)
+        expected = builder.build()
+
+        with pytest.raises(BudgetExceededError, match='4 clauses > 3'):
+            builder.filter('term', 'd', 4)
+        with pytest.raises(ValueError):
+            builder.filter('bool', lambda b: b.filter('term', 'e', 5))
+        assert builder.build() == expected
+        assert builder.clause_count == 3
+
+    def test__raise_on_nested(self):
+        builder = bodyBuilder(budget=Budget(max_depth=2, max_aggs=2))
+        builder.query('nested', 'path', 'a', lambda q: q.query('term', 'x', 1))
+        with pytest.raises(BudgetExceededError, match='depth'):
+            builder.query('nested', 'path', 'a', lambda q: q
+                          .query('nested', 'path', 'b', lambda r: r
+                                 .query('term', 'x', 1)))
+        builder = bodyBuilder(budget=Budget(max_aggs=2))
+        with pytest.raises(BudgetExceededError, match='aggregations'):
+            builder.aggregation('terms', 'user', lambda a: a
+                                .aggregation('terms', 'tag', lambda b: b
+                                             .aggregation('max', 'grade')))
+
+    def test__raise_on_bytes(self):
+        builder = bodyBuilder(budget=Budget(max_bytes=200))
+        builder.filter('terms', 'user', ['a' * 50])
+        with pytest.raises(BudgetExceededError, match='estimated bytes'):
+            builder.rawOption('_source', ['b' * 200])
+        assert '_source' not in builder.build()
+
+    def test__warn_once(self):
+        builder = bodyBuilder(budget=Budget(max_clauses=1, action='warn'))
+        builder.filter('term', 'a', 1)
+        with pytest.warns(BudgetWarning, match='2 clauses > 1'):
+            builder.filter('term', 'b', 2)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            builder.filter('term', 'c', 3)
+        assert len(builder.build()['query']['bool']['filter']) == 3
+
+    @pytest.mark.parametrize('add', [
+        lambda b: b.filter('term', 'b', 2),
+        lambda b: b.aggregation('terms', 'user'),
+        lambda b: b.orFilter_many('term', 'b', [2, 3]),
+        lambda b: b.size(10),
+        lambda b: b.freeze().query('match', 'message', 'test'),
+    ])
+    def test__warning_points_at_the_caller(self, add):
+        builder = bodyBuilder(budget=Budget(max_clauses=1, max_aggs=0,
+                                            max_bytes=30, action='warn'))
+        builder.filter('term', 'a', 1)
+        with pytest.warns(BudgetWarning) as record:
+            add(builder)
+        assert record[0].filename == __file__
+
+    def test__volatile_nested_is_not_counted(self):
+        builder = bodyBuilder(budget=Budget(max_clauses=1))
+        builder.filter('bool', Volatile(lambda b: b
+                                        .filter('term', 'a', 1)
+                                        .filter('term', 'b', 2)))
+        assert builder.clause_count == 1
+
+    def test__invalid_action(self):
+        with pytest.raises(ValueError):
+            Budget(action='ignore')
+
+    def test__clone_keeps_counts(self):
+        base = bodyBuilder(budget=Budget(max_clauses=2)) \
+            .filter('term', 'a', 1)
+        base.clone().filter('term', 'b', 2)
+        base.filter('term', 'c', 3)
+        with pytest.raises(BudgetExceededError):
+            base.filter('term', 'd', 4)
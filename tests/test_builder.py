@@ -2,9 +2,15 @@
 This file holds all the main tests
 """
 
+import array
+import copy
+import json
+import sys
+import threading
+
 import pytest
 
-from bodybuilder import BodyBuilder as bodyBuilder
+from bodybuilder import BodyBuilder as bodyBuilder, Volatile
 
 
 class TestBodyBuilder:
@@ -756,4 +762,524 @@ class TestBodyBuilder:
             }
         }
 
-        assert result == expected_query
\ No newline at end of file
+        assert result == expected_query
+
+    def test__build_is_memoized(self, monkeypatch):
+        result = bodyBuilder() \
+            .query('match', 'message', 'this is a test') \
+            .filter('term', 'user', 'kimchy')
+
+        calls = []
+        add_query_details = result.add_query_details
+        monkeypatch.setattr(result, 'add_query_details',
+                            lambda body=None: calls.append(1) or
+                            add_query_details(body))
+
+        result.getQuery()
+        result.build()
+        result.getFilter()
+        assert len(calls) == 1
+
+        result.size(10)
+        result.size(10)
+        result.build()
+        result.build()
+        assert len(calls) == 2
+
+        result.filter('term', 'user', 'herald')
+        assert len(result.build()['query']['bool']['filter']) == 2
+        assert len(calls) == 3
+
+    def test__build_result_is_a_copy(self):
+        result = bodyBuilder() \
+            .filter('term', 'user', 'kimchy') \
+            .rawOption('a', {'b': 'c'})
+
+        first = result.build()
+        first['query']['bool']['filter']['term']['user'] = 'herald'
+        first['a']['b'] = 'd'
+        result.getFilter()['term']['user'] = 'johnny'
+
+        expected_query = {
+            'query': {
+                'bool': {
+                    'filter': {
+                        'term': {
+                            'user': 'kimchy'
+                        }
+                    }
+                }
+            },
+            'a': {
+                'b': 'c'
+            }
+        }
+
+        assert result.build() == expected_query
+
+    def test__sibling_aggregations(self):
+        result = bodyBuilder() \
+            .aggregation('terms', 'user') \
+            .aggregation('avg', 'grade') \
+            .aggregation('terms', 'tags', 'tags',
+                         lambda a: a
+                         .aggregation('max', 'grade')
+                         .aggregation('min', 'grade')) \
+            .build()
+
+        expected_query = {
+            'aggs': {
+                'agg_terms_user': {
+                    'terms': {
+                        'field': 'user'
+                    }
+                },
+                'agg_avg_grade': {
+                    'avg': {
+                        'field': 'grade'
+                    }
+                },
+                'tags': {
+                    'terms': {
+                        'field': 'tags'
+                    },
+                    'aggs': {
+                        'agg_max_grade': {
+                            'max': {
+                                'field': 'grade'
+                            }
+                        },
+                        'agg_min_grade': {
+                            'min': {
+                                'field': 'grade'
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        assert result == expected_query
+
+    def test__duplicate_aggregation_names(self):
+        builder = bodyBuilder() \
+            .aggregation('terms', 'user', lambda a: a
+                         .aggregation('avg', 'grade'))
+
+        with pytest.raises(ValueError):
+            builder.aggregation('terms', 'user')
+        with pytest.raises(ValueError):
+            builder.aggregation('max', 'grade', 'agg_terms_user')
+        with pytest.raises(ValueError):
+            bodyBuilder().aggregation('terms', 'user', lambda a: a
+                                      .aggregation('avg', 'grade')
+                                      .aggregation('avg', 'grade'))
+        assert builder.build()['aggs']['agg_terms_user']['aggs'] == \
+            {'agg_avg_grade': {'avg': {'field': 'grade'}}}
+
+        clone = builder.clone().aggregation('terms', 'tag')
+        builder.aggregation('terms', 'tag')
+        assert list(clone.build()['aggs']) == list(builder.build()['aggs'])
+        with pytest.raises(ValueError):
+            builder.freeze().aggregation('terms', 'tag')
+
+    def test__clauses_are_parsed_on_registration(self):
+        with pytest.raises(IndexError) as e:
+            bodyBuilder().query('a', 'b', 'c', {}, 'e')
+        assert "Too many arguments to query!" in str(e.value)
+
+        with pytest.raises(ValueError):
+            bodyBuilder().aggregation('percentiles', {'percents': [1]})
+
+        result = bodyBuilder().filter('range', 'count', {'gt': 5}, {'boost': 2})
+        clause = result.filters[0]
+        assert (clause.type, clause.field, clause.value, clause.options) == \
+            ('range', 'count', {'gt': 5}, {'boost': 2})
+
+    def test__nested_lambdas_run_once(self):
+        calls = []
+
+        def nested(q):
+            calls.append(1)
+            return q.query('match', 'obj1.color', 'blue')
+
+        result = bodyBuilder() \
+            .query('nested', 'path', 'obj1', nested) \
+            .aggregation('terms', 'user', lambda a: calls.append(2) or
+                         a.aggregation('avg', 'grade'))
+
+        assert calls == [1, 2]
+        first = result.build()
+        result.size(10)
+        assert result.build()['query'] == first['query']
+        result.build_json()
+        assert calls == [1, 2]
+
+    def test__volatile_nested_lambda(self):
+        color = ['blue']
+        result = bodyBuilder() \
+            .query('nested', 'path', 'obj1',
+                   Volatile(lambda q: q.query('match', 'obj1.color', color[0])))
+
+        assert result.getQuery()['nested']['query'] == \
+            {'match': {'obj1.color': 'blue'}}
+
+        color[0] = 'red'
+        assert result.getQuery()['nested']['query'] == \
+            {'match': {'obj1.color': 'red'}}
+
+    def test__nested_function_without_return(self):
+        with pytest.raises(TypeError):
+            bodyBuilder().query('nested', 'path', 'o', lambda q: None)
+        with pytest.raises(TypeError):
+            bodyBuilder().filter('bool', lambda f: {'term': {'a': 1}})
+        with pytest.raises(TypeError):
+            bodyBuilder().aggregation('terms', 'user', lambda a: None)
+
+        volatile = bodyBuilder() \
+            .filter('bool', Volatile(lambda f: None))
+        with pytest.raises(TypeError):
+            volatile.build()
+        with pytest.raises(TypeError):
+            volatile.build_json()
+
+    def test__clone(self):
+        base = bodyBuilder() \
+            .filter('term', 'tenant', 'a') \
+            .notFilter('term', 'acl', 'hidden') \
+            .sort('timestamp') \
+            .size(10)
+        expected_base = base.build()
+
+        first = base.clone() \
+            .filter('term', 'user', 'kimchy') \
+            .sort('timestamp', 'desc') \
+            .rawOption('_source', ['user'])
+        second = base.clone().orFilter('term', 'user', 'herald').size(20)
+        base.from_(5)
+
+        assert first.build() == {
+            'query': {
+                'bool': {
+                    'filter': [
+                        {'term': {'tenant': 'a'}},
+                        {'term': {'user': 'kimchy'}}
+                    ],
+                    'must_not': [{'term': {'acl': 'hidden'}}]
+                }
+            },
+            'sort': [{'timestamp': {'order': 'desc'}}],
+            '_source': ['user'],
+            'size': 10
+        }
+        assert second.build()['query']['bool']['should'] == \
+            [{'term': {'user': 'herald'}}]
+        assert second.build()['size'] == 20
+        assert 'from' not in first.build() and 'from' not in second.build()
+        assert base.build() == dict(expected_base, **{'from': 5})
+
+    def test__clone_shares_clauses(self):
+        base = bodyBuilder()
+        for i in range(100):
+            base.filter('term', 'user', i)
+
+        clone = base.clone()
+        assert clone.filters is base.filters
+
+        clone.filter('term', 'user', 100)
+        assert len(base.filters) == 100
+        assert len(clone.filters) == 101
+        assert clone.filters[99] is base.filters[99]
+
+    def test__deepcopy_long_builder(self):
+        base = bodyBuilder()
+        for i in range(5000):
+            base.notFilter('term', 'acl', i)
+
+        assert copy.deepcopy(base).build() == base.build()
+
+    def test__deduplicate(self):
+        result = bodyBuilder(deduplicate=True) \
+            .filter('term', 'status', 'active') \
+            .filter('range', 'count', {'gt': 5, 'lt': 10}) \
+            .filter('term', 'status', 'active') \
+            .filter('range', 'count', {'lt': 10, 'gt': 5}) \
+            .orFilter('term', 'status', 'active') \
+            .orFilter('bool', lambda b: b.filter('term', 'user', 'kimchy')) \
+            .orFilter('bool', lambda b: b.filter('term', 'user', 'kimchy')) \
+            .notFilter('term', 'user', 'cassie')
+
+        expected_query = {
+            'query': {
+                'bool': {
+                    'filter': [
+                        {'term': {'status': 'active'}},
+                        {'range': {'count': {'gt': 5, 'lt': 10}}}
+                    ],
+                    'should': [
+                        {'term': {'status': 'active'}},
+                        {'bool': {'filter': {'term': {'user': 'kimchy'}}}}
+                    ],
+                    'must_not': [{'term': {'user': 'cassie'}}]
+                }
+            }
+        }
+
+        assert result.build() == expected_query
+        assert result.duplicates_dropped == 3
+        assert json.loads(result.build_json()) == expected_query
+
+    def test__deduplicate_single_remaining_clause(self):
+        result = bodyBuilder(deduplicate=True) \
+            .filter('term', 'status', 'active') \
+            .filter('term', 'status', 'active') \
+            .build()
+
+        assert result['query']['bool']['filter'] == \
+            {'term': {'status': 'active'}}
+
+    def test__deduplicate_keeps_json_types(self):
+        result = bodyBuilder(deduplicate=True) \
+            .filter('term', 'a', 1) \
+            .filter('term', 'a', True) \
+            .filter('term', 'a', 1.0) \
+            .filter('term', 'a', 1)
+
+        assert json.loads(result.build_json())['query']['bool']['filter'] == \
+            [{'term': {'a': 1}}, {'term': {'a': True}}, {'term': {'a': 1.0}}]
+        assert result.duplicates_dropped == 1
+
+    def test__deduplicate_does_not_share_clauses(self):
+        body = bodyBuilder(deduplicate=True) \
+            .filter('term', 'status', 'active') \
+            .orFilter('term', 'status', 'active') \
+            .orFilter('term', 'status', 'inactive') \
+            .build()
+
+        body['query']['bool']['filter']['term']['status'] = 'changed'
+        assert body['query']['bool']['should'][0] == \
+            {'term': {'status': 'active'}}
+
+    def test__no_deduplicate_by_default(self):
+        result = bodyBuilder() \
+            .filter('term', 'status', 'active') \
+            .filter('term', 'status', 'active')
+
+        assert len(result.build()['query']['bool']['filter']) == 2
+        assert result.duplicates_dropped == 0
+
+    def test__batch_terms(self):
+        result = bodyBuilder(batch_terms=True, max_terms_count=2) \
+            .orFilter('term', 'id', 1) \
+            .orFilter('term', 'tag', 'a') \
+            .orFilter('term', 'id', 2) \
+            .orFilter('term', 'id', 3) \
+            .orFilter('term', 'id', {'value': 4, 'boost': 2}) \
+            .notFilter('term', 'user', 'cassie') \
+            .notFilter('term', 'user', 'johnny') \
+            .filter('term', 'tag', 'a') \
+            .filter('term', 'tag', 'b')
+
+        expected_query = {
+            'query': {
+                'bool': {
+                    'filter': [
+                        {'term': {'tag': 'a'}},
+                        {'term': {'tag': 'b'}}
+                    ],
+                    'should': [
+                        {'terms': {'id': [1, 2]}},
+                        {'terms': {'id': [3]}},
+                        {'term': {'tag': 'a'}},
+                        {'term': {'id': {'value': 4, 'boost': 2}}}
+                    ],
+                    'must_not': [{'terms': {'user': ['cassie', 'johnny']}}]
+                }
+            }
+        }
+
+        assert result.build() == expected_query
+        assert json.loads(result.build_json()) == expected_query
+
+    def test__freeze(self):
+        builder = bodyBuilder() \
+            .query('match', 'message', 'this is a test') \
+            .aggregation('terms', 'user')
+        frozen = builder.freeze()
+        expected = frozen.build()
+        builder.filter('term', 'user', 'kimchy').size(10)
+
+        assert isinstance(frozen, bodyBuilder)
+        assert frozen.build() == expected
+        assert frozen.freeze() is frozen
+        assert frozen.clone() is frozen
+        assert frozen.thaw().size(10).build() == dict(expected, size=10)
+        assert frozen.build() == expected
+        with pytest.raises(ValueError):
+            bodyBuilder().query('nested', 'path', 'obj1', Volatile(
+                lambda q: q.query('match', 'obj1.name', 'blue'))).freeze()
+
+    def test__add_query_details_does_not_touch_shared_bodies(self):
+        original = bodyBuilder().filter('term', 'tenant', 'a')
+        expected = original.build()
+        frozen = original.freeze()
+
+        clone = original.clone().filter('term', 'user', 'x')
+        clone.add_query_details()
+        frozen.filter('term', 'user', 'y').add_query_details()
+
+        assert original.build() == expected
+        assert frozen.build() == expected
+        assert clone.body['query']['bool']['filter'] == [
+            {'term': {'tenant': 'a'}}, {'term': {'user': 'x'}}]
+
+    def test__frozen_chain_returns_new_builders(self):
+        base = bodyBuilder().filter('term', 'tenant', 'a').freeze()
+        kimchy = base.filter('term', 'user', 'kimchy')
+        herald = base.filter('term', 'user', 'herald').size(10)
+        sorted_kimchy = kimchy.sort('timestamp').rawOption('_source', False)
+
+        assert isinstance(kimchy, type(base))
+        assert base.build() == {
+            'query': {'bool': {'filter': {'term': {'tenant': 'a'}}}}}
+        assert kimchy.build() == {'query': {'bool': {'filter': [
+            {'term': {'tenant': 'a'}}, {'term': {'user': 'kimchy'}}]}}}
+        assert herald.build() == {'query': {'bool': {'filter': [
+            {'term': {'tenant': 'a'}}, {'term': {'user': 'herald'}}]}},
+            'size': 10}
+        assert sorted_kimchy.build() == dict(
+            kimchy.build(), sort=[{'timestamp': {'order': 'asc'}}],
+            _source=False)
+        assert 'sort' not in kimchy.build()
+        assert kimchy.filters[0] is herald.filters[0]
+
+        nested = base.aggregation('terms', 'user', lambda a: a
+                                  .aggregation('max', 'grade'))
+        assert nested.build()['aggs'] == {'agg_terms_user': {
+            'terms': {'field': 'user'},
+            'aggs': {'agg_max_grade': {'max': {'field': 'grade'}}}}}
+        with pytest.raises(ValueError):
+            base.query('nested', 'path', 'obj1', Volatile(
+                lambda q: q.query('match', 'obj1.name', 'blue')))
+
+    def test__concurrent_builds(self):
+        def shared_builder(volatile):
+            nested = lambda q: q.query('term', 'obj1.name', 'blue')
+            builder = bodyBuilder() \
+                .query('match', 'message', 'this is a test') \
+                .filter('nested', 'path', 'obj1',
+                        Volatile(nested) if volatile else nested)
+            for i in range(50):
+                builder.filter('term', 'user', f'user_{i}')
+                builder.notFilter('term', 'tag', f'tag_{i}')
+            return builder.sort('timestamp').size(10) \
+                .aggregation('terms', 'user', lambda a: a
+                             .aggregation('max', 'grade'))
+
+        expected = shared_builder(False).build()
+        expected_json = json.dumps(expected)
+        # rebuilt on every build()
+        volatile = shared_builder(True)
+        frozen = shared_builder(False).freeze()
+        start = threading.Barrier(16)
+        results = []
+
+        def worker():
+            start.wait()
+            for _ in range(100):
+                results.append(volatile.build() == expected and
+                               volatile.build_json() == expected_json and
+                               frozen.build() == expected and
+                               frozen.build_json() == expected_json)
+
+        threads = [threading.Thread(target=worker) for _ in range(16)]
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(switch_interval)
+
+        assert len(results) == 16 * 100
+        assert all(results)
+
+    @pytest.mark.parametrize('method', ['query', 'filter', 'orFilter',
+                                        'notFilter'])
+    @pytest.mark.parametrize('count', [1, 2, 300])
+    def test__many_is_the_same_as_a_loop(self, method, count):
+        ids = [f'id_{i}' for i in range(count)]
+        looped = bodyBuilder().filter('term', 'tenant', 'a')
+        for value in ids:
+            getattr(looped, method)('term', 'user', value, {'boost': 2})
+        looped.orFilter('match', 'message', 'test')
+        many = bodyBuilder().filter('term', 'tenant', 'a')
+        getattr(many, method + '_many')('term', 'user', iter(ids),
+                                        {'boost': 2})
+        many.orFilter('match', 'message', 'test')
+
+        assert many.build() == looped.build()
+        assert many.build_json() == json.dumps(looped.build())
+        assert many.clause_count == looped.clause_count
+
+        single = getattr(bodyBuilder(), method + '_many')('term', 'user', ids)
+        single_loop = bodyBuilder()
+        for value in ids:
+            getattr(single_loop, method)('term', 'user', value)
+        assert single.build() == single_loop.build()
+        assert single.build_json() == json.dumps(single_loop.build())
+
+        frozen = getattr(bodyBuilder().filter('term', 'tenant', 'a').freeze(),
+                         method + '_many')('term', 'user', ids,
+                                           options={'boost': 2})
+        frozen = frozen.orFilter('match', 'message', 'test')
+        assert frozen.build() == looped.build()
+
+    def test__many_ranges(self):
+        result = bodyBuilder() \
+            .orFilter_many('range', 'count', [(0, 10), (10, 100), (100, None)])
+
+        assert result.build() == {'query': {'bool': {'should': [
+            {'range': {'count': {'gte': 0, 'lt': 10}}},
+            {'range': {'count': {'gte': 10, 'lt': 100}}},
+            {'range': {'count': {'gte': 100}}},
+        ]}}}
+        assert result.build_json() == json.dumps(result.build())
+
+    def test__many_from_arrays(self):
+        ids = array.array('q', [3, 1, 2])
+        result = bodyBuilder().orFilter_many('term', 'id', ids) \
+            .notFilter_many('range', 'count', array.array('d', [0, 1, 5, 9]))
+        ids[0] = 4
+
+        assert result.build() == bodyBuilder() \
+            .orFilter('term', 'id', 3).orFilter('term', 'id', 1) \
+            .orFilter('term', 'id', 2) \
+            .notFilter('range', 'count', {'gte': 0.0, 'lt': 1.0}) \
+            .notFilter('range', 'count', {'gte': 5.0, 'lt': 9.0}).build()
+        assert result.clause_count == 5
+
+    def test__many_from_numpy(self):
+        numpy = pytest.importorskip('numpy')
+        result = bodyBuilder() \
+            .filter_many('terms', 'id', numpy.arange(3).reshape(3, 1)) \
+            .orFilter_many('range', 'count',
+                           numpy.array([[0, 10], [10, 20]]))
+
+        assert result.build() == {'query': {'bool': {
+            'filter': [{'terms': {'id': [i]}} for i in range(3)],
+            'should': [{'range': {'count': {'gte': 0, 'lt': 10}}},
+                       {'range': {'count': {'gte': 10, 'lt': 20}}}]}}}
+        assert result.build_json() == json.dumps(result.build())
+
+    def test__many_with_batch_terms_and_nothing(self):
+        result = bodyBuilder(batch_terms=True) \
+            .orFilter_many('term', 'user', ['kimchy', 'herald']) \
+            .orFilter('term', 'user', 'johnny') \
+            .notFilter_many('term', 'user', [])
+
+        assert result.build() == {'query': {'bool': {'should': [
+            {'terms': {'user': ['kimchy', 'herald', 'johnny']}}]}}}
+        assert len(result.notFilters) == 0
@@ -0,0 +1,137 @@
+"""
+Tests for the columnar aggregation response decoder
+"""
+
+import array
+import math
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+
+
+def builder():
+    return bodyBuilder() \
+        .aggregation('avg', 'price') \
+        .aggregation('terms', 'user', lambda a: a
+                     .aggregation('percentiles', 'load', {'percents': [50]})
+                     .aggregation('date_histogram', 'timestamp',
+                                  {'interval': 'day'}, lambda d: d
+                                  .aggregation('max', 'grade')
+                                  .aggregation('stats', 'count'))) \
+        .aggregation('filter', None, {'term': {'tag': 'a'}}, 'tagged',
+                     lambda f: f.aggregation('sum', 'price')) \
+        .aggregation('filters', None, {'filters': {
+            'errors': {'term': {'level': 'error'}}}}, 'levels')
+
+
+def stats(value):
+    return {'count': 1, 'min': value, 'max': value, 'avg': value,
+            'sum': value}
+
+
+RESPONSE = {
+    'took': 3,
+    'aggregations': {
+        'agg_avg_price': {'value': 12.5},
+        'agg_terms_user': {'buckets': [
+            {'key': 'kimchy', 'doc_count': 3,
+             'agg_percentiles_load': {'values': {'50.0': 7.0}},
+             'agg_date_histogram_timestamp': {'buckets': [
+                 {'key': 1000, 'doc_count': 2,
+                  'agg_max_grade': {'value': 9.0},
+                  'agg_stats_count': stats(4)},
+                 {'key': 2000, 'doc_count': 1,
+                  'agg_max_grade': {'value': None},
+                  'agg_stats_count': stats(5)},
+             ]}},
+            {'key': 'herald', 'doc_count': 1,
+             'agg_percentiles_load': {'values': {'50.0': 2.0}},
+             'agg_date_histogram_timestamp': {'buckets': [
+                 {'key': 1000, 'doc_count': 1,
+                  'agg_max_grade': {'value': 3.0}},
+             ]}},
+        ]},
+        'tagged': {'doc_count': 2, 'agg_sum_price': {'value': 20.0}},
+        'levels': {'buckets': {'errors': {'doc_count': 4}}},
+    },
+}
+
+
+class TestDecoder:
+
+    def test__tables(self):
+        decoded = builder().aggregation_decoder().decode(RESPONSE)
+
+        assert decoded == {
+            '': {'agg_avg_price': [12.5]},
+            'agg_terms_user': {
+                'agg_terms_user': ['kimchy', 'herald'],
+                'doc_count': [3, 1],
+                'agg_percentiles_load.50.0': [7.0, 2.0],
+            },
+            'agg_terms_user>agg_date_histogram_timestamp': {
+                'agg_terms_user': ['kimchy', 'kimchy', 'herald'],
+                'agg_date_histogram_timestamp': [1000, 2000, 1000],
+                'doc_count': [2, 1, 1],
+                'agg_max_grade': [9.0, None, 3.0],
+                'agg_stats_count.count': [1, 1, None],
+                'agg_stats_count.min': [4, 5, None],
+                'agg_stats_count.max': [4, 5, None],
+                'agg_stats_count.avg': [4, 5, None],
+                'agg_stats_count.sum': [4, 5, None],
+            },
+            'tagged': {'doc_count': [2], 'agg_sum_price': [20.0]},
+            'levels': {'levels': ['errors'], 'doc_count': [4]},
+        }
+
+    def test__declared_tables(self):
+        decoder = builder().aggregation_decoder()
+
+        assert decoder.tables['tagged'] == ['doc_count', 'agg_sum_price']
+        assert decoder.decode(RESPONSE['aggregations']) == \
+            decoder.decode(RESPONSE)
+
+    def test__missing_aggregations(self):
+        decoded = builder().aggregation_decoder().decode({'took': 1})
+
+        assert decoded['agg_terms_user>agg_date_histogram_timestamp'][
+            'doc_count'] == []
+        assert decoded[''] == {'agg_avg_price': [None]}
+
+    def test__array_columns(self):
+        table = builder().aggregation_decoder().decode(
+            RESPONSE, columns='array')[
+                'agg_terms_user>agg_date_histogram_timestamp']
+
+        assert table['agg_date_histogram_timestamp'] == \
+            array.array('q', [1000, 2000, 1000])
+        assert table['agg_max_grade'][0] == 9.0
+        assert math.isnan(table['agg_max_grade'][1])
+        assert table['agg_terms_user'] == ['kimchy', 'kimchy', 'herald']
+        with pytest.raises(ValueError):
+            builder().aggregation_decoder().decode(RESPONSE, columns='csv')
+
+    def test__numpy_columns(self):
+        numpy = pytest.importorskip('numpy')
+        table = builder().aggregation_decoder().decode(
+            RESPONSE, columns='numpy')['agg_terms_user']
+
+        assert isinstance(table['doc_count'], numpy.ndarray)
+
+    def test__large_response(self):
+        users, days = 100, 1000
+        response = {'aggregations': {'agg_terms_user': {'buckets': [
+            {'key': f'user_{u}', 'doc_count': days,
+             'agg_date_histogram_timestamp': {'buckets': [
+                 {'key': d * 86400000, 'doc_count': 1,
+                  'agg_max_grade': {'value': float(u * d)}}
+                 for d in range(days)]}}
+            for u in range(users)]}}}
+        table = builder().aggregation_decoder().decode(
+            response, columns='array')[
+                'agg_terms_user>agg_date_histogram_timestamp']
+
+        assert len(table['doc_count']) == users * days
+        assert table['agg_max_grade'][-1] == (users - 1) * (days - 1)
+        assert table['agg_terms_user'][days] == 'user_1'
@@ -0,0 +1,120 @@
+"""
+Tests for sliced parallel export, against a local stand-in of the search
+endpoint
+"""
+
+import io
+import json
+import threading
+import time
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+from bodybuilder.export import iter_export, slice_builders, write_export
+
+
+class SlicedSearch:
+
+    """
+    Returns the documents of the requested slice sorted by `_id`, honouring
+    `search_after` and `size`, after `delay` seconds
+    """
+
+    def __init__(self, count=1000, delay=0.0, fail_slice=None):
+        self.docs = [{'_id': f'{i:06}', 'count': i} for i in range(count)]
+        self.delay = delay
+        self.fail_slice = fail_slice
+        self.lock = threading.Lock()
+        self.bodies = []
+
+    def __call__(self, body):
+        with self.lock:
+            self.bodies.append(body)
+        time.sleep(self.delay)
+        assert body['pit'] == {'id': 'pit_0', 'keep_alive': '1m'}
+        sliced = body['slice']
+        if sliced['id'] == self.fail_slice:
+            raise RuntimeError('slice failed')
+        hits = [dict(doc, sort=[doc['_id']]) for doc in self.docs
+                if doc['count'] % sliced['max'] == sliced['id']]
+        if 'search_after' in body:
+            hits = [hit for hit in hits
+                    if hit['sort'] > body['search_after']]
+        return {'hits': {'hits': hits[:body['size']]}}
+
+
+def builder():
+    return bodyBuilder().query('match_all').size(50)
+
+
+class TestExport:
+
+    def test__slice_builders(self):
+        original = builder()
+        sliced = slice_builders(original, 3)
+
+        assert [clone.build()['slice'] for clone in sliced] == \
+            [{'id': i, 'max': 3} for i in range(3)]
+        assert 'slice' not in original.build()
+
+    @pytest.mark.parametrize('slices', [2, 3, 8])
+    def test__every_hit_once(self, slices):
+        search = SlicedSearch()
+        hits = list(iter_export(builder(), search, slices=slices, pit='pit_0'))
+
+        assert sorted(hit['_id'] for hit in hits) == \
+            [doc['_id'] for doc in search.docs]
+        for i in range(slices):
+            ids = [hit['_id'] for hit in hits if hit['count'] % slices == i]
+            assert ids == sorted(ids)
+
+    def test__write_export(self):
+        fp = io.BytesIO()
+        written = write_export(builder(), SlicedSearch(count=120), fp,
+                               slices=4, pit='pit_0')
+
+        lines = fp.getvalue().splitlines()
+        assert written == len(lines) == 120
+        assert {json.loads(line)['_id'] for line in lines} == \
+            {f'{i:06}' for i in range(120)}
+
+    def test__slices_run_concurrently(self):
+        def export(slices):
+            started = time.perf_counter()
+            hits = list(iter_export(builder(), SlicedSearch(count=400,
+                                                            delay=0.02),
+                                    slices=slices, pit='pit_0'))
+            assert len(hits) == 400
+            return time.perf_counter() - started
+
+        assert export(8) < export(2) / 2
+
+    def test__bounded_pages_per_slice(self):
+        search = SlicedSearch(count=2000)
+        hits = iter_export(builder(), search, slices=2, pit='pit_0',
+                           pages_per_slice=2)
+        next(hits)
+        time.sleep(0.1)
+
+        # one page being consumed, two queued and one being fetched per slice
+        assert len(search.bodies) <= 2 * 4
+        hits.close()
+        requested = len(search.bodies)
+        time.sleep(0.05)
+        assert len(search.bodies) == requested
+
+    def test__needs_point_in_time_and_slices(self):
+        search = SlicedSearch()
+        with pytest.raises(ValueError):
+            iter_export(builder(), search, slices=4)
+        with pytest.raises(ValueError):
+            iter_export(builder(), search, slices=1, pit='pit_0')
+        with pytest.raises(ValueError):
+            write_export(builder(), search, io.BytesIO(), slices=4)
+        assert search.bodies == []
+
+    def test__failing_slice(self):
+        with pytest.raises(RuntimeError):
+            list(iter_export(builder(), SlicedSearch(fail_slice=1),
+                             slices=3, pit='pit_0'))
@@ -0,0 +1,69 @@
+"""
+Tests for multi-search NDJSON generation
+"""
+
+import io
+import json
+import types
+
+from bodybuilder import BodyBuilder as bodyBuilder, Param, \
+    iter_msearch, iter_msearch_template, write_msearch
+
+
+class TestMsearch:
+
+    def test__builders(self):
+        first = bodyBuilder().filter('term', 'user', 'kimchy')
+        second = bodyBuilder().query('match_all').size(5)
+
+        lines = list(iter_msearch([first, second], {'index': 'tweets'}))
+
+        assert lines == [
+            b'{"index": "tweets"}\n',
+            json.dumps(first.build()).encode() + b'\n',
+            b'{"index": "tweets"}\n',
+            b'{"query": {"match_all": {}}, "size": 5}\n',
+        ]
+
+    def test__per_search_header(self):
+        lines = list(iter_msearch([
+            ({'index': 'a'}, bodyBuilder().query('match_all')),
+            {'size': 0},
+        ]))
+
+        assert lines == [
+            b'{"index": "a"}\n',
+            b'{"query": {"match_all": {}}}\n',
+            b'{}\n',
+            b'{"size": 0}\n',
+        ]
+
+    def test__template_is_lazy(self):
+        template = bodyBuilder() \
+            .filter('term', 'user', Param('user')) \
+            .compile()
+        rendered = []
+
+        def param_sets():
+            for user in ['kimchy', 'herald']:
+                rendered.append(user)
+                yield {'user': user}
+
+        lines = iter_msearch_template(template, param_sets())
+        assert isinstance(lines, types.GeneratorType)
+        assert rendered == []
+
+        assert next(lines) == b'{}\n'
+        assert next(lines) == \
+            b'{"query": {"bool": {"filter": {"term": {"user": "kimchy"}}}}}\n'
+        assert rendered == ['kimchy']
+
+    def test__write(self):
+        buffer = io.BytesIO()
+        searches = [bodyBuilder().size(i + 1) for i in range(3)]
+
+        written = write_msearch(searches, buffer)
+
+        assert written == len(buffer.getvalue())
+        assert buffer.getvalue().decode().splitlines()[1::2] == \
+            ['{"size": 1}', '{"size": 2}', '{"size": 3}']
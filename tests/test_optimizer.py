@@ -0,0 +1,198 @@
+"""
+Tests for the query tree optimizer behind build(optimize=True)
+"""
+
+import itertools
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+
+
+def matches(clause, doc):
+    """
+    Tiny reference implementation of the matching of the queries used below
+    """
+    (query_type, inner), = clause.items()
+    if query_type == 'term':
+        (field, value), = inner.items()
+        return doc.get(field) == value
+    if query_type == 'terms':
+        (field, values), = inner.items()
+        return doc.get(field) in values
+    if query_type == 'range':
+        (field, bounds), = inner.items()
+        return field in doc and all(
+            {'gt': doc[field] > v, 'gte': doc[field] >= v,
+             'lt': doc[field] < v, 'lte': doc[field] <= v}[op]
+            for op, v in bounds.items())
+    if query_type == 'exists':
+        return inner['field'] in doc
+    if query_type == 'constant_score':
+        return matches(inner['filter'], doc)
+    if query_type == 'bool':
+        def occurrence(name):
+            value = inner.get(name, [])
+            return value if isinstance(value, list) else [value]
+        required = occurrence('must') + occurrence('filter')
+        should = occurrence('should')
+        minimum = inner.get('minimum_should_match',
+                            0 if required or not should else 1)
+        return all(matches(c, doc) for c in required) and \
+            not any(matches(c, doc) for c in occurrence('must_not')) and \
+            sum(matches(c, doc) for c in should) >= minimum
+    raise ValueError(query_type)
+
+
+DOCS = [
+    {'user': user, 'count': count, 'tag': tag}
+    for user, count, tag in itertools.product(
+        ['kimchy', 'herald', 'johnny'], [1, 5, 10], ['a', 'b'])
+] + [{'user': 'cassie'}, {}]
+
+
+def term(field, value):
+    return {'term': {field: value}}
+
+
+QUERIES = [
+    {'bool': {'filter': [
+        {'bool': {'filter': [term('user', 'kimchy'), term('tag', 'a')],
+                  'must_not': [term('count', 5)]}},
+        {'range': {'count': {'gte': 1}}}
+    ]}},
+    {'bool': {'must': {'bool': {'must': [term('user', 'kimchy')]}},
+              'should': [term('tag', 'a')]}},
+    {'bool': {'must': [], 'filter': [{'bool': {}}],
+              'must_not': [term('user', 'herald')]}},
+    {'bool': {'filter': {'bool': {}}, 'should': [term('tag', 'b')]}},
+    {'bool': {'should': [
+        {'bool': {'must': [{'bool': {'filter': term('user', 'kimchy')}}]}},
+        {'bool': {'must_not': [term('user', 'kimchy')]}},
+    ], 'minimum_should_match': 1}},
+    {'constant_score': {'filter': {'bool': {
+        'must': [term('user', 'johnny'), {'exists': {'field': 'tag'}}],
+        'filter': {'bool': {'must': [{'range': {'count': {'lt': 10}}}]}}
+    }}}},
+]
+
+
+class TestOptimizer:
+
+    @pytest.mark.parametrize('query', QUERIES)
+    @pytest.mark.parametrize('sort', [False, True])
+    def test__same_matches(self, query, sort):
+        builder = bodyBuilder().rawOption('query', query)
+        if sort:
+            builder.sort('count')
+        optimized = builder.build(optimize=True)['query']
+
+        for doc in DOCS:
+            assert matches(optimized, doc) == matches(query, doc), doc
+
+    @pytest.mark.parametrize('builder', [
+        bodyBuilder().query('match', 'message', 'this is a test')
+        .filter('term', 'user', 'kimchy'),
+        bodyBuilder().filter('constant_score',
+                             lambda f: f.filter('term', 'user', 'kimchy'))
+        .filter('term', 'message', 'this is a test'),
+        bodyBuilder().query('match', 'message', 'this is a test')
+        .filter('term', 'user', 'kimchy')
+        .filter('term', 'user', 'herald')
+        .orFilter('term', 'user', 'johnny')
+        .notFilter('term', 'user', 'cassie'),
+        bodyBuilder().orFilter('bool', lambda f: f
+                               .filter('terms', 'tags', ['Popular'])
+                               .filter('terms', 'brands', ['A', 'B']))
+        .orFilter('bool', lambda f: f
+                  .filter('terms', 'tags', ['Emerging'])
+                  .filter('terms', 'brands', ['C'])),
+        bodyBuilder().query('nested', 'path', 'obj1', {'score_mode': 'avg'},
+                            lambda q: q
+                            .query('match', 'obj1.name', 'blue')
+                            .query('range', 'obj1.count', {'gt': 5})),
+    ])
+    def test__optimal_bodies_are_unchanged(self, builder):
+        assert builder.build(optimize=True) == builder.build()
+
+    def test__flatten_nested_filter(self):
+        result = bodyBuilder() \
+            .filter('bool', lambda b: b
+                    .filter('term', 'user', 'kimchy')
+                    .filter('term', 'tag', 'a')) \
+            .filter('range', 'count', {'gt': 5}) \
+            .build(optimize=True)
+
+        assert result == {
+            'query': {
+                'bool': {
+                    'filter': [
+                        {'term': {'user': 'kimchy'}},
+                        {'term': {'tag': 'a'}},
+                        {'range': {'count': {'gt': 5}}}
+                    ]
+                }
+            }
+        }
+
+    def test__hoist_must_when_sorting_on_fields(self):
+        builder = bodyBuilder() \
+            .query('term', 'user', 'kimchy') \
+            .query('range', 'count', {'gt': 5}) \
+            .notFilter('term', 'tag', 'b')
+
+        assert 'must' in builder.build(optimize=True)['query']['bool']
+
+        builder.sort('timestamp', 'desc')
+        assert builder.build(optimize=True)['query'] == {
+            'bool': {
+                'filter': [
+                    {'term': {'user': 'kimchy'}},
+                    {'range': {'count': {'gt': 5}}}
+                ],
+                'must_not': [{'term': {'tag': 'b'}}]
+            }
+        }
+
+        builder.sort('_score')
+        assert 'must' in builder.build(optimize=True)['query']['bool']
+
+    @pytest.mark.parametrize('builder', [
+        bodyBuilder().aggregation('terms', 'tag', 'by_tag', lambda a: a
+                                  .aggregation('top_hits', {'size': 3},
+                                               'best')),
+        bodyBuilder().rawOption('size', 0)
+        .aggregation('terms', 'tag', 'by_tag', lambda a: a
+                     .aggregation('top_hits', {'size': 3}, 'best')),
+        bodyBuilder().rawOption('aggregations',
+                                {'best': {'top_hits': {'size': 3}}}),
+        bodyBuilder().rawOption('rescore', {'query': {'rescore_query': {
+            'match_phrase': {'title': 'foo'}}}}),
+        bodyBuilder().rawOption('collapse', {'field': 'user'}),
+    ])
+    def test__keep_scores_read_by_other_parts(self, builder):
+        builder.query('match', 'title', 'foo') \
+            .query('match', 'body', 'bar') \
+            .sort('date', 'desc')
+
+        assert builder.build(optimize=True)['query'] == \
+            builder.build()['query']
+
+    def test__unwrap_single_clause_bool(self):
+        result = bodyBuilder() \
+            .rawOption('query', {'bool': {'must': [
+                {'bool': {'must': {'match': {'message': 'test'}}}}
+            ]}}) \
+            .build(optimize=True)
+
+        assert result == {'query': {'match': {'message': 'test'}}}
+
+    def test__does_not_change_cached_body(self):
+        builder = bodyBuilder() \
+            .query('term', 'user', 'kimchy') \
+            .query('term', 'tag', 'a') \
+            .sort('timestamp')
+        expected = builder.build()
+
+        builder.build(optimize=True)
+        assert builder.build() == expected
@@ -0,0 +1,140 @@
+"""
+Tests for search_after pagination, against a local stand-in of the search
+endpoint
+"""
+
+import threading
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+
+
+class StandInSearch:
+
+    """
+    Sorts its documents as asked, honours `search_after`, `size` and `pit`,
+    and records the bodies it got
+    """
+
+    def __init__(self, count=1000, pit=False):
+        self.docs = [{'_id': f'{i:06}', 'user': f'user_{i % 7}',
+                      'count': i % 13} for i in range(count)]
+        self.pit = pit
+        self.bodies = []
+        self.prefetched = threading.Event()
+
+    def sort_values(self, position, doc, sorts):
+        values = []
+        for sort in sorts:
+            (field, order), = sort.items()
+            value = position if field == '_shard_doc' else doc[field]
+            values.append(value)
+        return values
+
+    def key(self, values, sorts):
+        return tuple(-value if sort[next(iter(sort))]['order'] == 'desc'
+                     else value for value, sort in zip(values, sorts))
+
+    def __call__(self, body):
+        self.bodies.append(body)
+        if len(self.bodies) > 1:
+            self.prefetched.set()
+        sorts = body['sort']
+        hits = [dict(doc, sort=self.sort_values(position, doc, sorts))
+                for position, doc in enumerate(self.docs)]
+        hits.sort(key=lambda hit: self.key(hit['sort'], sorts))
+        if 'search_after' in body:
+            after = self.key(body['search_after'], sorts)
+            hits = [hit for hit in hits
+                    if self.key(hit['sort'], sorts) > after]
+        response = {'hits': {'hits': hits[:body['size']]}}
+        if self.pit:
+            response['pit_id'] = f"pit_{len(self.bodies)}"
+        return response
+
+
+def builder():
+    return bodyBuilder().query('match_all').sort('count', 'desc')
+
+
+class TestPagination:
+
+    @pytest.mark.parametrize('prefetch', [True, False])
+    def test__every_hit_once_in_order(self, prefetch):
+        search = StandInSearch()
+        hits = list(builder().size(64).iter_hits(search, '_id',
+                                                 prefetch=prefetch))
+
+        assert len(hits) == 1000
+        assert len({hit['_id'] for hit in hits}) == 1000
+        assert [(-hit['count'], hit['_id']) for hit in hits] == \
+            sorted((-doc['count'], doc['_id']) for doc in search.docs)
+        assert len(search.bodies) == 16
+        assert search.bodies[0]['sort'] == [{'count': {'order': 'desc'}},
+                                            {'_id': {'order': 'asc'}}]
+        assert 'search_after' not in search.bodies[0]
+        assert search.bodies[1]['search_after'] == hits[63]['sort']
+
+    def test__builder_is_unchanged(self):
+        paged = builder().from_(20)
+        list(paged.iter_hits(StandInSearch(count=10), '_id'))
+
+        assert paged.build() == builder().from_(20).build()
+
+    def test__default_size_and_full_last_page(self):
+        search = StandInSearch(count=2000)
+        hits = list(builder().sort('_id').iter_hits(search, '_id'))
+
+        assert len(hits) == 2000
+        assert [body['size'] for body in search.bodies] == [1000] * 3
+        assert 'from' not in search.bodies[0]
+        assert search.bodies[0]['sort'][-1] == {'_id': {'order': 'asc'}}
+
+    def test__point_in_time(self):
+        search = StandInSearch(count=100, pit=True)
+        hits = list(builder().size(30).iter_hits(search, pit='pit_0',
+                                                 keep_alive='5m'))
+
+        assert len({hit['_id'] for hit in hits}) == 100
+        assert [body['pit'] for body in search.bodies] == [
+            {'id': f'pit_{i}', 'keep_alive': '5m'} for i in range(4)]
+        assert search.bodies[0]['sort'][-1] == \
+            {'_shard_doc': {'order': 'asc'}}
+
+    def test__prefetch_and_bounded_pages(self):
+        search = StandInSearch()
+        hits = builder().size(10).iter_hits(search, '_id')
+
+        next(hits)
+        # the second page is fetched while the first one is consumed
+        assert search.prefetched.wait(5)
+        for _ in range(25):
+            next(hits)
+        # never more than one page ahead of the consumer
+        assert len(search.bodies) <= 4
+        hits.close()
+        assert len(search.bodies) <= 4
+
+    def test__frozen_builder(self):
+        search = StandInSearch(count=50)
+        hits = list(builder().size(20).freeze().iter_hits(search, '_id'))
+
+        assert len(hits) == 50
+
+    def test__errors(self):
+        def failing(body):
+            if 'search_after' in body:
+                raise RuntimeError('search failed')
+            return {'hits': {'hits': [{'_id': str(i), 'sort': [i]}
+                                      for i in range(body['size'])]}}
+
+        hits = builder().size(5).iter_hits(failing, '_id')
+        with pytest.raises(RuntimeError):
+            list(hits)
+        with pytest.raises(ValueError):
+            list(builder().size(1).iter_hits(
+                lambda body: {'hits': {'hits': [{'_id': '1'}]}}, '_id'))
+        # sorting on _id is disabled by default since Elasticsearch 8
+        with pytest.raises(ValueError):
+            builder().iter_hits(failing)
@@ -0,0 +1,150 @@
+"""
+Tests for parsing bodies back into builders with BodyBuilder.from_body
+"""
+
+import json
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder, FrozenBodyBuilder
+
+BUILDERS = [
+    bodyBuilder(),
+    bodyBuilder().query('match_all'),
+    bodyBuilder().query('match', 'message', 'this is a test'),
+    bodyBuilder().filter('term', 'user', 'kimchy'),
+    bodyBuilder().query('match', 'message', 'this is a test')
+    .filter('term', 'user', 'kimchy')
+    .filter('term', 'user', 'herald')
+    .orFilter('term', 'user', 'johnny')
+    .notFilter('term', 'user', 'cassie'),
+    bodyBuilder().query('term', 'a', 1).query('term', 'b', 2),
+    bodyBuilder().orFilter('bool', lambda f: f
+                           .filter('terms', 'tags', ['Popular'])
+                           .filter('terms', 'brands', ['A', 'B'])),
+    bodyBuilder().query('nested', 'path', 'obj1', {'score_mode': 'avg'},
+                        lambda q: q
+                        .query('match', 'obj1.name', 'blue')
+                        .query('range', 'obj1.count', {'gt': 5})),
+    bodyBuilder().filter('constant_score',
+                         lambda f: f.filter('term', 'user', 'kimchy')),
+    bodyBuilder().aggregation('terms', 'user')
+    .aggregation('percentiles', 'load_time', {'percents': [95, 99]},
+                 'load_time_outlier')
+    .aggregation('date_histogram', 'grades', {'interval': 'day'},
+                 lambda a: a.aggregation('max', 'grade')
+                 .aggregation('terms', 'tag', lambda b: b
+                              .aggregation('avg', 'price'))),
+    bodyBuilder().aggregation('filters', None, {'filters': {
+        'a': {'term': {'tag': 'a'}}}}, 'tagged'),
+    bodyBuilder().query('match_all').sort('timestamp', 'desc').sort('_score')
+    .from_(20).size(10).rawOption('_source', ['user'])
+    .rawOption('track_total_hits', True),
+]
+
+BODIES = [
+    {'query': {'bool': {'must': {'match': {'message': 'a'}}}}},
+    {'query': {'bool': {'must': [{'match': {'message': 'a'}}]}}},
+    {'query': {'bool': {'filter': [{'term': {'a': 1}}],
+                        'minimum_should_match': 1,
+                        'should': {'term': {'b': 2}}}}},
+    {'query': {'bool': {'should': []}}},
+    {'query': {'bool': {}}},
+    {'query': {'term': {'a': 1}, 'match': {'b': 2}}},
+    {'query': 'not a clause'},
+    {'sort': ['_score', {'timestamp': 'desc'}]},
+    {'sort': [{'a': {'order': 'asc'}}, {'a': {'order': 'desc'}}]},
+    {'sort': [{'a': {'order': 'asc', 'mode': 'avg'}}]},
+    {'from': 0, 'size': 0},
+    {'aggs': {}},
+    {'aggs': {'a': {'terms': {'field': 'x'}, 'meta': {'b': 1}}}},
+    {'aggs': {'a': {'terms': {'field': 'x'}, 'aggs': {}}}},
+    {'aggs': {'a': {'terms': {'field': 'x', 'size': 5}}}},
+    {'aggs': {'a': {'terms': {'field': 'x'}, 'aggs': {
+        'b': {'max': {'field': 'y'}}, 'c': 'broken'}}}},
+    {'query': {'match_all': {}}, 'highlight': {'fields': {'message': {}}},
+     'post_filter': {'term': {'a': 1}}, 'search_after': [1, 'a']},
+]
+
+
+class TestParser:
+
+    @pytest.mark.parametrize('builder', BUILDERS)
+    def test__round_trip_builders(self, builder):
+        body = builder.build()
+        parsed = bodyBuilder.from_body(body)
+
+        assert parsed.build() == body
+        assert parsed.build_json() == json.dumps(body)
+
+    @pytest.mark.parametrize('body', BODIES)
+    def test__round_trip_bodies(self, body):
+        assert bodyBuilder.from_body(body).build() == body
+
+    def test__clause_lists(self):
+        parsed = bodyBuilder.from_body(BUILDERS[4].build())
+
+        assert [len(parsed.queries), len(parsed.filters),
+                len(parsed.orFilters), len(parsed.notFilters)] == [1, 2, 1, 1]
+        assert parsed.clause_count == 5
+
+    def test__extend_stored_query(self):
+        stored = {
+            'query': {'bool': {'must': {'match': {'message': 'test'}},
+                               'filter': {'term': {'user': 'kimchy'}}}},
+            'aggs': {'users': {'terms': {'field': 'user'}}},
+            'size': 10,
+        }
+        builder = bodyBuilder.from_body(stored) \
+            .filter('term', 'tenant', 'a') \
+            .aggregation('max', 'grade')
+
+        assert builder.build() == {
+            'query': {'bool': {
+                'must': {'match': {'message': 'test'}},
+                'filter': [{'term': {'user': 'kimchy'}},
+                           {'term': {'tenant': 'a'}}]}},
+            'aggs': {'users': {'terms': {'field': 'user'}},
+                     'agg_max_grade': {'max': {'field': 'grade'}}},
+            'size': 10,
+        }
+        assert stored['query']['bool']['filter'] == \
+            {'term': {'user': 'kimchy'}}
+
+    def test__non_canonical_query_is_kept_as_one_clause(self):
+        query = {'bool': {'must': [{'match': {'message': 'a'}}]}}
+        builder = bodyBuilder.from_body({'query': query}) \
+            .filter('term', 'tenant', 'a')
+
+        assert builder.build()['query'] == {'bool': {
+            'must': query, 'filter': {'term': {'tenant': 'a'}}}}
+
+    @pytest.mark.parametrize('query', [
+        {'bool': {'should': [{'term': {'user': 'kimchy'}},
+                             {'term': {'user': 'herald'}}]}},
+        {'bool': {'should': [{'term': {'user': 'kimchy'}}],
+                  'must_not': [{'term': {'tag': 'a'}}]}},
+    ])
+    def test__should_only_query_stays_required(self, query):
+        parsed = bodyBuilder.from_body({'query': query})
+
+        assert parsed.build() == {'query': query}
+        assert len(parsed.orFilters) == 0
+        assert parsed.filter('term', 'tenant', 't1').build()['query'] == {
+            'bool': {'must': query, 'filter': {'term': {'tenant': 't1'}}}}
+
+    def test__input_is_copied(self):
+        body = {'query': {'terms': {'user': ['kimchy']}}}
+        builder = bodyBuilder.from_body(body)
+        body['query']['terms']['user'].append('herald')
+
+        assert builder.build() == {'query': {'terms': {'user': ['kimchy']}}}
+
+    def test__frozen(self):
+        body = BUILDERS[4].build()
+        frozen = FrozenBodyBuilder.from_body(body)
+
+        assert isinstance(frozen, FrozenBodyBuilder)
+        assert frozen.build() == body
+        assert frozen.size(5).build() == dict(body, size=5)
+
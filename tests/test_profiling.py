@@ -0,0 +1,107 @@
+"""
+Tests for the opt-in build instrumentation
+"""
+
+import logging
+import pstats
+
+from bodybuilder import BodyBuilder as bodyBuilder, profile_builds
+from bodybuilder import profiling
+
+
+def nested_builder():
+    return bodyBuilder() \
+        .query('match', 'message', 'this is a test') \
+        .filter('bool', lambda b: b
+                .filter('nested', 'path', 'obj1',
+                        lambda q: q.query('term', 'obj1.name', 'blue'))) \
+        .sort('timestamp') \
+        .aggregation('terms', 'user', lambda a: a.aggregation('max', 'grade'))
+
+
+class TestProfiling:
+
+    def test__no_hooks_by_default(self):
+        assert profiling.hooks == []
+        assert nested_builder().build()
+
+    def test__profile_stages_and_counts(self):
+        builder = nested_builder()
+        with profile_builds() as profiles:
+            body = builder.build()
+            builder.build()
+
+        assert body == nested_builder().build()
+        assert profiling.hooks == []
+        assert len(profiles) == 1
+        profile, = profiles
+        assert list(profile.stages) == [
+            'add_query_details', '_add_sorts', '_add_rawOptions', '_add_misc',
+            '_add_aggs']
+        assert profile.total >= sum(profile.stages.values())
+        assert profile.clauses == {'queries': 1, 'filters': 1, 'orFilters': 0,
+                                   'notFilters': 0, 'aggs': 1, 'sorts': 1}
+        assert profile.depth == 3
+        assert [child.depth for child in profile.children] == [2, 1]
+        assert len(profile.children[0].children) == 1
+        assert set(profile.nested_stages) == {'add_query_details',
+                                              '_add_aggs'}
+        assert profile.as_dict()['stages']['nested'] == profile.nested
+
+    def test__allocations(self):
+        builder = bodyBuilder()
+        for i in range(1000):
+            builder.filter('term', 'user', f'user_{i}')
+        with profile_builds(allocations=True) as profiles:
+            builder.build()
+
+        assert profiles[0].allocations['add_query_details'] > 1000
+
+    def test__hook_callback(self):
+        seen = []
+        profiling.add_build_hook(seen.append)
+        try:
+            bodyBuilder().query('match_all').build()
+        finally:
+            profiling.remove_build_hook(seen.append)
+        bodyBuilder().query('match_all').build()
+
+        assert len(seen) == 1
+
+    def test__log_profiles(self, caplog):
+        with profile_builds() as profiles:
+            nested_builder().build()
+        with caplog.at_level(logging.DEBUG, logger='bodybuilder.profiling'):
+            profiling.log_profiles(profiles)
+
+        assert 'add_query_details=' in caplog.text
+        assert 'depth=3' in caplog.text
+
+    def test__openmetrics(self):
+        with profile_builds(allocations=True) as profiles:
+            nested_builder().build()
+            nested_builder().build()
+        text = profiling.to_openmetrics(profiles)
+
+        assert text.endswith('# EOF\n')
+        assert 'bodybuilder_builds_total 2\n' in text
+        assert 'bodybuilder_build_clauses_total{kind="queries"} 2\n' in text
+        assert 'bodybuilder_build_max_depth 3\n' in text
+        assert 'bodybuilder_build_stage_seconds_total{stage="_add_aggs"}' \
+            in text
+        assert 'bodybuilder_build_stage_allocated_bytes_total' in text
+
+    def test__pstats(self, tmp_path):
+        with profile_builds() as profiles:
+            nested_builder().build()
+            nested_builder().build()
+        path = str(tmp_path / 'build.prof')
+        profiling.dump_stats(profiles, path)
+
+        stats = pstats.Stats(path)
+        functions = {function[2]: values
+                     for function, values in stats.stats.items()}
+        assert functions['build'][1] == 2
+        assert functions['add_query_details'][1] == 2
+        assert functions['nested'][1] == 4
+        assert abs(stats.total_tt - sum(p.total for p in profiles)) < 1e-9
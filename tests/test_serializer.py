@@ -0,0 +1,118 @@
+"""
+Tests for the direct-to-JSON serializer
+"""
+
+import json
+import tracemalloc
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder
+
+
+def assert_same_json(builder):
+    assert builder.build_json() == json.dumps(builder.build())
+    assert builder.build_bytes() == json.dumps(builder.build()).encode()
+
+
+class TestSerializer:
+
+    def test__empty(self):
+        assert_same_json(bodyBuilder())
+
+    def test__simple_query(self):
+        assert_same_json(bodyBuilder().query('match_all'))
+        assert_same_json(bodyBuilder().query('exists', 'user'))
+        assert_same_json(bodyBuilder().query('term', 'user', 'kimchy'))
+
+    def test__query_filter_aggs(self):
+        assert_same_json(
+            bodyBuilder()
+            .query('match', 'message', 'this is a test')
+            .filter('term', 'user', 'kimchy')
+            .filter('term', 'user', 'herald')
+            .orFilter('term', 'user', 'johnny')
+            .notFilter('term', 'user', 'cassie')
+            .aggregation('terms', 'user')
+            .sort('timestamp', 'desc')
+            .sort('_score')
+            .from_(10)
+            .size(20)
+        )
+
+    def test__nested(self):
+        assert_same_json(
+            bodyBuilder()
+            .query('match', 'title', 'eggs')
+            .query('nested', 'path', 'comments', {'score_mode': 'max'},
+                   lambda q: q
+                   .query('match', 'comments.name', 'john')
+                   .query('match', 'comments.age', 28))
+            .filter('constant_score',
+                    lambda f: f.filter('term', 'user', 'kimchy'))
+            .aggregation("a", "b", {"c": "d"}, "e",
+                         lambda x: x.aggregation(
+                             "f", "g",
+                             lambda y: y.aggregation("h", "i", "j")))
+        )
+
+    def test__sibling_aggregations(self):
+        assert_same_json(
+            bodyBuilder()
+            .aggregation('terms', 'user')
+            .aggregation('avg', 'grade', 'avg_grade')
+            .aggregation('max', 'grade', 'max_grade')
+            .aggregation('terms', 'tags',
+                         lambda a: a
+                         .aggregation('max', 'grade')
+                         .aggregation('min', 'grade'))
+        )
+
+    def test__options_and_raw_options_override(self):
+        assert_same_json(
+            bodyBuilder()
+            .query('geo_distance', 'point', {'lat': 40, 'lon': 20},
+                   {'distance': '12km', 'point': 'override'})
+            .size(10)
+            .rawOption('size', 5)
+            .rawOption('query', {'match_all': {}})
+            .rawOption('_source', ['ünïcode', 1.5, None, True])
+        )
+
+    def test__errors_match_build(self):
+        with pytest.raises(IndexError):
+            bodyBuilder().query('a', 'b', 'c', {}, 'e').build_json()
+        with pytest.raises(IndexError):
+            bodyBuilder().aggregation('a').build_json()
+        with pytest.raises(TypeError):
+            bodyBuilder().filter('term', 'user', object()).build_json()
+
+    def test__iter_json_chunks(self):
+        builder = bodyBuilder().query('match', 'message', 'this is a test')
+        for i in range(1000):
+            builder.filter('term', 'user', f'user_{i}')
+            builder.orFilter('nested', 'path', 'obj',
+                             lambda q: q.query('match', 'obj.id', i))
+        builder.aggregation('terms', 'user',
+                            lambda a: a.aggregation('avg', 'grade'))
+
+        chunks = list(builder.iter_json(chunk_size=4096))
+
+        assert len(chunks) > 10
+        assert all(len(chunk) < 2 * 4096 for chunk in chunks[:-1])
+        assert ''.join(chunks) == json.dumps(builder.build())
+        assert b''.join(builder.iter_bytes()) == builder.build_bytes()
+
+    def test__iter_json_memory_is_bounded(self):
+        builder = bodyBuilder()
+        for i in range(20000):
+            builder.filter('term', 'user', f'user_{i}')
+        size = len(builder.build_json())
+
+        tracemalloc.start()
+        for _ in builder.iter_json(chunk_size=4096):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        assert peak < size / 4
@@ -0,0 +1,93 @@
+"""
+Tests for builders described by declarative specs
+"""
+
+import json
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder, build_spec, compile_spec
+from bodybuilder import spec as spec_module
+
+SPEC = [
+    {'op': 'query', 'args': ['match', 'message', {'$param': 'text'}]},
+    {'op': 'filter', 'args': ['term', 'user', {'$param': 'user'}]},
+    {'op': 'orFilter', 'args': ['bool'], 'children': [
+        {'op': 'filter', 'args': ['terms', 'tags', ['Popular']]},
+        {'op': 'filter', 'args': ['range', 'count', {'gte': 5}]},
+    ]},
+    {'op': 'aggregation', 'args': ['terms', 'user'], 'children': [
+        {'op': 'aggregation', 'args': ['max', 'grade']},
+    ]},
+    {'op': 'sort', 'args': ['timestamp', 'desc']},
+    {'op': 'from', 'args': [20]},
+    {'op': 'size', 'args': [{'$param': 'size'}]},
+]
+
+
+def chain(text, user, size):
+    return bodyBuilder() \
+        .query('match', 'message', text) \
+        .filter('term', 'user', user) \
+        .orFilter('bool', lambda b: b
+                  .filter('terms', 'tags', ['Popular'])
+                  .filter('range', 'count', {'gte': 5})) \
+        .aggregation('terms', 'user', lambda a: a.aggregation('max', 'grade')) \
+        .sort('timestamp', 'desc') \
+        .from_(20) \
+        .size(size)
+
+
+class TestSpec:
+
+    def setup_method(self):
+        spec_module._cache.clear()
+
+    def test__build_spec(self):
+        params = {'text': 'this is a test', 'user': 'kimchy', 'size': 10}
+        spec = [dict(entry) for entry in SPEC]
+        spec[0]['args'] = ['match', 'message', params['text']]
+        spec[1]['args'] = ['term', 'user', params['user']]
+        spec[-1]['args'] = [params['size']]
+
+        assert build_spec(spec).build() == chain(**params).build()
+        assert build_spec(json.dumps(spec)).build() == chain(**params).build()
+
+    def test__compile_spec(self):
+        template = compile_spec(SPEC)
+
+        assert template.params == {'text', 'user', 'size'}
+        assert template.render(text='test', user='herald', size=5) == \
+            chain('test', 'herald', 5).build()
+
+    def test__compiled_once_per_content(self, monkeypatch):
+        calls = []
+        compile_builder = bodyBuilder.compile
+        monkeypatch.setattr(bodyBuilder, 'compile', lambda builder:
+                            calls.append(1) or compile_builder(builder))
+        reordered = [{key: entry[key] for key in reversed(list(entry))}
+                     for entry in SPEC]
+
+        first = compile_spec(SPEC)
+        assert compile_spec(json.loads(json.dumps(SPEC))) is first
+        assert compile_spec(reordered) is first
+        text = json.dumps(SPEC)
+        assert compile_spec(text) is compile_spec(text)
+        assert len(calls) == 2
+
+    def test__cache_is_bounded(self, monkeypatch):
+        monkeypatch.setattr(spec_module, '_CACHE_SIZE', 3)
+        for size in range(5):
+            compile_spec([{'op': 'size', 'args': [size + 1]}])
+        assert len(spec_module._cache) == 3
+
+    @pytest.mark.parametrize('spec', [
+        {'op': 'size', 'args': [1]},
+        [{'args': [1]}],
+        [{'op': 'build'}],
+        [{'op': '__init__'}],
+        [{'op': 'size', 'args': [1], 'children': []}],
+    ])
+    def test__invalid_specs(self, spec):
+        with pytest.raises(ValueError):
+            build_spec(spec)
@@ -0,0 +1,110 @@
+"""
+Tests for compiled query templates
+"""
+
+import pytest
+
+from bodybuilder import BodyBuilder as bodyBuilder, Param
+
+
+class TestTemplate:
+
+    def test__render_filter(self):
+        template = bodyBuilder() \
+            .filter('term', 'user', Param('user')) \
+            .compile()
+
+        expected_query = {
+            'query': {
+                'bool': {
+                    'filter': {
+                        'term': {
+                            'user': 'kimchy'
+                        }
+                    }
+                }
+            }
+        }
+
+        assert template.params == {'user'}
+        assert template.render(user='kimchy') == expected_query
+
+    def test__render_matches_build(self):
+        def chain(user, count, size):
+            return bodyBuilder() \
+                .query('match', 'message', 'this is a test') \
+                .filter('term', 'user', user) \
+                .filter('range', 'count', {'gt': count}) \
+                .aggregation('terms', 'user') \
+                .sort('timestamp', 'desc') \
+                .size(size)
+
+        template = chain(Param('user'), Param('count'), Param('size')).compile()
+
+        assert template.render(user='kimchy', count=5, size=10) == \
+            chain('kimchy', 5, 10).build()
+        assert template.render(user='herald', count=1, size=20) == \
+            chain('herald', 1, 20).build()
+
+    def test__render_falsy_from_and_size(self):
+        def chain(start, size):
+            return bodyBuilder().query('match_all').from_(start).size(size)
+
+        template = chain(Param('start'), Param('size')).compile()
+
+        for start, size in [(0, 0), (0, 10), (20, 0), (20, 10)]:
+            assert template.render(start=start, size=size) == \
+                chain(start, size).build()
+        assert bodyBuilder().rawOption('size', Param('size')).compile() \
+            .render(size=0) == {'size': 0}
+
+    def test__render_nested(self):
+        template = bodyBuilder() \
+            .query('nested', 'path', 'obj1',
+                   lambda q: q.query('match', 'obj1.color', Param('color'))) \
+            .compile()
+
+        expected_query = {
+            'query': {
+                'nested': {
+                    'path': 'obj1',
+                    'query': {
+                        'match': {
+                            'obj1.color': 'blue'
+                        }
+                    }
+                }
+            }
+        }
+
+        assert template.render(color='blue') == expected_query
+
+    def test__render_param_as_field(self):
+        template = bodyBuilder() \
+            .filter('term', Param('field'), 'value') \
+            .compile()
+
+        result = template.render(field='user')
+
+        assert result['query']['bool']['filter'] == {'term': {'user': 'value'}}
+
+    def test__renders_are_independent(self):
+        template = bodyBuilder() \
+            .filter('terms', 'tags', ['a', Param('tag')]) \
+            .compile()
+
+        first = template.render(tag='b')
+        first['query']['bool']['filter']['terms']['tags'].append('c')
+
+        assert template.render(tag='b')['query']['bool']['filter'] == {
+            'terms': {'tags': ['a', 'b']}
+        }
+
+    def test__missing_param(self):
+        template = bodyBuilder() \
+            .filter('term', 'user', Param('user')) \
+            .compile()
+
+        with pytest.raises(KeyError) as e:
+            template.render()
+        assert "user" in str(e.value)